@@ -1,10 +1,19 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from webdriver_manager.chrome import ChromeDriverManager
+# selenium and webdriver_manager are imported inside the browser functions, so the HTTP collector
+# and anything importing this module (the pipeline, tests) start without loading them
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.managers import SyncManager
+import json
+import logging
+import math
+import queue
+import shutil
+import signal
 import time
 import os
+import requests
+
+import pexels_http
+from metrics import Registry, Reporter
 
 # List of keywords
 keywords = [
@@ -84,54 +93,280 @@ keywords = [
     "Restaurant",
 ]
 
-# Set up Chrome options
-options = Options()
-options.add_argument("--disable-dev-shm-usage")
-options.add_argument("--no-sandbox")
-# Uncomment if you want to run in headless mode
-# options.add_argument('--headless')
+COLLECTION_MODE = "http"  # "http" reads result pages directly, "browser" scrolls them in Chrome
+URL_DIR = "pexels_image_urls"  # Directory to save URLs
+IMAGES_PER_KEYWORD = 100
+GRID_ITEM_CLASS = "BreakpointGrid_item__RSMyf"
+PAGE_LOAD_TIMEOUT = 15  # Seconds to wait for the first results to render
+STALL_TIMEOUT = 5  # Seconds to wait for a scroll to load more results before giving up
+POLL_INTERVAL = 0.2  # Seconds between checks while waiting
+BROWSER_WORKERS = os.cpu_count() or 1  # Chrome instances crawling in parallel; 1 keeps a single visible browser
+KEYWORDS_PER_DRIVER = 10  # Restart Chrome after this many keywords to cap its memory growth
+CHROMEDRIVER_PATH = os.environ.get("CHROMEDRIVER_PATH")  # Pin a local chromedriver and skip resolution entirely
+DRIVER_CACHE_PATH = ".chromedriver.json"  # Where the last resolved chromedriver path is remembered
+DRIVER_CACHE_TTL = 7 * 24 * 3600  # Seconds before ChromeDriverManager is asked again for a newer driver
+
+METRICS_PATH = "pexels_metrics.prom"  # Prometheus text file rewritten while the crawl runs
+LOG_LEVEL = logging.INFO  # DEBUG logs every stored URL
+
+log = logging.getLogger("pexels")
+METRICS = Registry("pexels_")
+KEYWORDS_DONE = METRICS.counter("keywords_total", "Keywords crawled by result", ["result"])
+IMAGES = METRICS.counter("images_total", "Image URLs collected")
+SCROLLS = METRICS.counter("scrolls_total", "Scrolls issued in the browser")
+PHASE_SECONDS = METRICS.histogram("keyword_seconds", "Time per keyword by phase", ["phase"], buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+
+# Count the rendered grid items without pulling element handles back over WebDriver
+COUNT_ITEMS_SCRIPT = "return document.getElementsByClassName(arguments[0]).length;"
+
+# Read src, srcset, alt and photo id of the first N grid items in a single round-trip
+EXTRACT_PHOTOS_SCRIPT = """
+const items = document.getElementsByClassName(arguments[0]);
+const photos = [];
+for (let i = 0; i < items.length && photos.length < arguments[1]; i++) {
+    const img = items[i].querySelector("img");
+    if (!img || !img.src) continue;
+    const link = items[i].querySelector("a[href*='/photo/']");
+    const match = link ? link.getAttribute("href").match(/(\\d+)\\/?$/) : null;
+    photos.push({id: match ? match[1] : null, src: img.src, srcset: img.getAttribute("srcset"), alt: img.getAttribute("alt")});
+}
+return photos;
+"""
+
+
+# Function to find chromedriver: the pinned path, a recent cached resolution, or ChromeDriverManager,
+# falling back to the cached or PATH driver when offline; None leaves it to Selenium Manager
+def resolve_driver_path(pinned=CHROMEDRIVER_PATH, cache_path=DRIVER_CACHE_PATH, ttl=DRIVER_CACHE_TTL):
+    if pinned:
+        return pinned
+    cached = None
+    try:
+        with open(cache_path, "r") as file:
+            entry = json.load(file)
+        if os.path.isfile(entry["path"]):
+            cached = entry["path"]
+            if time.time() - float(entry["resolved_at"]) < ttl:
+                return cached
+    except (OSError, ValueError, TypeError, KeyError):
+        pass  # No cache yet, or a half-written or malformed one: resolve again
+
+    try:
+        from webdriver_manager.chrome import ChromeDriverManager
+
+        driver_path = ChromeDriverManager().install()
+    except Exception as e:  # Offline, rate limited or webdriver_manager missing
+        driver_path = None
+        log.warning("Could not resolve chromedriver (%s)", e)
+    if not driver_path:
+        fallback = cached or shutil.which("chromedriver")
+        log.warning("Using %s as chromedriver", fallback or "Selenium Manager")
+        return fallback
+
+    with open(cache_path, "w") as file:
+        json.dump({"path": driver_path, "resolved_at": time.time()}, file)
+    return driver_path
 
-# Initialize the Chrome driver
-driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
 
-# Create a directory to save URLs
-if not os.path.exists("pexels_image_urls"):
-    os.makedirs("pexels_image_urls")
+# Function to start Chrome
+def create_driver(driver_path=None, headless=False):
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
 
-# Iterate over each keyword
-for keyword in keywords:
-    # Open Pexels website with the search keyword
+    # Set up Chrome options
+    options = Options()
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--no-sandbox")
+    if headless:
+        options.add_argument("--headless=new")
+    return webdriver.Chrome(service=Service(driver_path or resolve_driver_path()), options=options)
+
+
+# Function to scroll a keyword's search page in the browser and collect its photos' URLs and metadata
+def scrape_keyword(driver, keyword):
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    timing = {}
+    start = time.perf_counter()
+
+    # Open Pexels website with the search keyword and wait for the first results instead of a fixed sleep
     search_url = f"https://www.pexels.com/search/{keyword}/"
     driver.get(search_url)
-    time.sleep(5)  # Wait for the page to load
+    try:
+        WebDriverWait(driver, PAGE_LOAD_TIMEOUT, POLL_INTERVAL).until(EC.presence_of_element_located((By.CLASS_NAME, GRID_ITEM_CLASS)))
+    except TimeoutException:
+        log.warning("No results rendered for %s within %ss", keyword, PAGE_LOAD_TIMEOUT)
+    timing["load"] = time.perf_counter() - start
 
-    image_elements = []
-    scroll_pause_time = 2
-    previous_count = 0
+    item_count = driver.execute_script(COUNT_ITEMS_SCRIPT, GRID_ITEM_CLASS)
+    timing["scrolls"] = 0
 
-    # Scroll until we have at least 100 images or no change in image count
-    while len(image_elements) < 100:
+    # Scroll until we have at least 100 images or a scroll stops loading new ones
+    while item_count < IMAGES_PER_KEYWORD:
+        previous_count = item_count
         driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-        time.sleep(scroll_pause_time)  # Wait to load page
-        image_elements = driver.find_elements(By.CLASS_NAME, "BreakpointGrid_item__RSMyf")
-
-        if len(image_elements) == previous_count:
+        timing["scrolls"] += 1
+        try:
+            item_count = WebDriverWait(driver, STALL_TIMEOUT, POLL_INTERVAL).until(
+                lambda d: (count := d.execute_script(COUNT_ITEMS_SCRIPT, GRID_ITEM_CLASS)) > previous_count and count
+            )
+        except TimeoutException:
             # No change in image count after scrolling
             break
-        previous_count = len(image_elements)
+    timing["scroll"] = time.perf_counter() - start - timing["load"]
+
+    photos = driver.execute_script(EXTRACT_PHOTOS_SCRIPT, GRID_ITEM_CLASS, IMAGES_PER_KEYWORD)  # Get up to the first 100 images
+    timing["extract"] = time.perf_counter() - start - timing["load"] - timing["scroll"]
+    timing["total"] = time.perf_counter() - start
+    return photos, timing
+
+
+# Function to write a keyword's image URLs to its file
+def save_image_urls(keyword, urls, url_dir=URL_DIR):
+    # Create a directory to save URLs
+    if not os.path.exists(url_dir):
+        os.makedirs(url_dir)
 
     # File to save image URLs
-    folder_name = f"pexels_image_urls/{keyword.replace(' ', '_')}.txt"
-    with open(folder_name, "w") as file:
-        for index, element in enumerate(image_elements[:100]):  # Get up to the first 100 images
+    file_name = f"{url_dir}/{keyword.replace(' ', '_')}.txt"
+    with open(file_name, "w") as file:
+        for index, img_url in enumerate(urls):
+            file.write(f"{img_url}\n")
+            log.debug("Stored URL for image_%d.jpg: %s", index, img_url)
+
+
+# Function to write a keyword's photo metadata (id, src, srcset, alt) next to its URL file
+def save_image_metadata(keyword, photos, url_dir=URL_DIR):
+    if not os.path.exists(url_dir):
+        os.makedirs(url_dir)
+    with open(f"{url_dir}/{keyword.replace(' ', '_')}.jsonl", "w") as file:
+        for photo in photos:
+            file.write(json.dumps(photo) + "\n")
+
+
+# Function to record where a keyword's time went; runs in the parent, since metrics in pool workers are not collected
+def report_timing(keyword, count, timing):
+    KEYWORDS_DONE.inc(result="ok" if count else "empty")
+    IMAGES.inc(count)
+    SCROLLS.inc(timing["scrolls"])
+    for phase in ("load", "scroll", "extract", "total"):
+        PHASE_SECONDS.observe(timing[phase], phase=phase)
+    log.info(
+        "%s: %d images in %.1fs (load %.1fs, scroll %.1fs over %d scrolls, extract %.1fs)",
+        keyword, count, timing["total"], timing["load"], timing["scroll"], timing["scrolls"], timing["extract"],
+    )
+
+
+# Function to crawl one shard of keywords in its own Chrome, yielding each keyword's result as soon as it is saved
+def iter_shard(shard, driver_path=None, headless=True, stop=None):
+    driver = create_driver(driver_path, headless)
+    try:
+        for keyword in shard:
+            if stop is not None and stop.is_set():
+                return
+            photos, timing = scrape_keyword(driver, keyword)
+            urls = [photo["src"] for photo in photos]
+            save_image_urls(keyword, urls)
+            save_image_metadata(keyword, photos)
+            yield keyword, urls, timing
+    finally:
+        # Close the driver
+        driver.quit()
+
+
+# Function to crawl one shard as a process pool task, putting each keyword's result on the shared results queue
+def crawl_shard(shard, results, stop, driver_path=None, headless=True):
+    for result in iter_shard(shard, driver_path, headless, stop):
+        results.put(result)
+
+
+# Function run at the start of every helper process; Ctrl-C reaches the whole process group, and only the parent decides to stop
+def ignore_signals():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)  # Drops any handler inherited from the parent
+
+
+# Function to collect every keyword by scrolling the search pages in Chrome; on_keyword(keyword, urls) sees each result
+def crawl_with_browser(keywords, workers=BROWSER_WORKERS, keywords_per_driver=KEYWORDS_PER_DRIVER, on_keyword=None):
+    # Resolve the driver once so the workers do not all check versions or download it at the same time
+    driver_path = resolve_driver_path()
+    if workers <= 1:
+        for start in range(0, len(keywords), keywords_per_driver):
+            for keyword, urls, timing in iter_shard(keywords[start : start + keywords_per_driver], driver_path, headless=False):
+                report_timing(keyword, len(urls), timing)
+                if on_keyword is not None:
+                    on_keyword(keyword, urls)
+        return
+
+    # Each task is one driver lifetime; shards small enough to keep every worker busy until the end
+    shard_size = max(1, min(keywords_per_driver, math.ceil(len(keywords) / workers)))
+    shards = [keywords[start : start + shard_size] for start in range(0, len(keywords), shard_size)]
+    manager = SyncManager()
+    manager.start(ignore_signals)
+    results, stop = manager.Queue(), manager.Event()
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=ignore_signals)
+    try:
+        tasks = {executor.submit(crawl_shard, shard, results, stop, driver_path): shard for shard in shards}
+        reported = set()
+        while tasks:
+            finished = [future for future in tasks if future.done()]
             try:
-                img_tag = element.find_element(By.TAG_NAME, "img")
-                img_url = img_tag.get_attribute("src")
-                if img_url:
-                    file.write(f"{img_url}\n")
-                    print(f"Stored URL for image_{index}.jpg: {img_url}")
-            except Exception as e:
-                print(f"Could not store URL for image_{index}.jpg: {e}")
-
-# Close the driver
-driver.quit()
+                keyword, urls, timing = results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                # Everything the finished shards queued has been handled, so what they did not report failed
+                for future in finished:
+                    shard = tasks.pop(future)
+                    if future.exception() is not None:
+                        missing = [keyword for keyword in shard if keyword not in reported]
+                        KEYWORDS_DONE.inc(len(missing), result="failed")
+                        log.error("Shard %s failed with %d keywords left: %s", shard, len(missing), future.exception())
+                continue
+            reported.add(keyword)
+            report_timing(keyword, len(urls), timing)
+            if on_keyword is not None:
+                on_keyword(keyword, urls)
+    finally:
+        # When on_keyword ends the crawl early, queued shards are dropped and running ones stop after their current keyword
+        stop.set()
+        executor.shutdown(cancel_futures=True)
+        manager.shutdown()
+
+
+# Function to collect every keyword by reading the search pages over plain HTTP; on_keyword(keyword, urls) sees each result
+def crawl_with_http(keywords, base=pexels_http.SEARCH_BASE, on_keyword=None):
+    session = pexels_http.create_session()
+    for keyword in keywords:
+        try:
+            with PHASE_SECONDS.time(phase="total"):
+                urls = pexels_http.collect_image_urls(session, keyword, IMAGES_PER_KEYWORD, base)
+        except requests.exceptions.RequestException as e:
+            # One unreachable page only costs its keyword; the previous URL file, if any, is kept
+            KEYWORDS_DONE.inc(result="failed")
+            log.error("Keyword %s failed: %s", keyword, e)
+            continue
+        save_image_urls(keyword, urls)
+        KEYWORDS_DONE.inc(result="ok" if urls else "empty")
+        IMAGES.inc(len(urls))
+        if on_keyword is not None:
+            on_keyword(keyword, urls)
+
+
+# Function to collect every keyword with the configured collection mode
+def crawl(keywords, mode=COLLECTION_MODE, on_keyword=None):
+    if mode == "browser":
+        crawl_with_browser(keywords, on_keyword=on_keyword)
+    else:
+        crawl_with_http(keywords, on_keyword=on_keyword)
+
+
+def main(metrics_path=METRICS_PATH):
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    with Reporter(METRICS, metrics_path, logger=log):
+        crawl(keywords)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Ad counts per day, publisher, domain, cities and category, accumulated across divar.py runs.
+
+    python aggregate_store.py                       # publisher shares over all days
+    python aggregate_store.py --since 2026-10-01 --until 2026-10-31 --daily
+"""
+
+import argparse
+import sqlite3
+from array import array
+from datetime import datetime
+
+AGGREGATES_PATH = "divar_aggregates.sqlite"
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS daily (
+        day TEXT NOT NULL,
+        publisher TEXT NOT NULL,
+        domain TEXT NOT NULL,
+        cities TEXT NOT NULL,
+        category TEXT NOT NULL,
+        ad_count INTEGER NOT NULL,
+        impression_count INTEGER NOT NULL,
+        PRIMARY KEY (day, publisher, domain, cities, category)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS runs (
+        run_at TEXT PRIMARY KEY,
+        day TEXT NOT NULL,
+        placements INTEGER NOT NULL
+    )
+    """,
+]
+
+# Shares are taken within each group of the window, so the same query serves whole-window and per-day views
+SHARES_QUERY = """
+SELECT {group_columns}publisher, ad_count, impression_count,
+       1.0 * ad_count / SUM(ad_count) OVER (PARTITION BY {partition}),
+       1.0 * impression_count / NULLIF(SUM(impression_count) OVER (PARTITION BY {partition}), 0)
+FROM (
+    SELECT {group_columns}publisher, SUM(ad_count) AS ad_count, SUM(impression_count) AS impression_count
+    FROM daily
+    WHERE day >= ? AND day <= ?
+    GROUP BY {group_columns}publisher
+)
+ORDER BY {group_columns}ad_count DESC
+"""
+
+
+class AggregateStore:
+    """Persistent daily aggregates that each run merges its own placements into.
+
+    A run's placements are summed in memory under its (publisher, domain,
+    cities, category) keys. Domains, city lists and categories are interned
+    to small ints and the sums live in array-backed columns, so a long run
+    holds a few ints per distinct key rather than a tuple of strings.
+    merge() upserts them into the day's rows in one transaction, together
+    with a runs row; a run that was already merged is skipped, so merging
+    twice never double counts. close() does not merge, so a run that fails
+    before merge() leaves the table untouched. Placements answered from the
+    response cache were merged by the run that fetched them and are not
+    counted again. Share queries then read the small daily table for any
+    window instead of raw placements.
+    add() matches ResultExporter.add.
+    """
+
+    def __init__(self, publishers=(), path=AGGREGATES_PATH, run_at=None):
+        self.publishers = publishers
+        self.run_at = run_at or datetime.now().isoformat(timespec="milliseconds")
+        self.day = self.run_at[:10]
+        self._labels = {}
+        self._label_values = []
+        self._rows = {}  # Interned (publisher, domain, cities, category) key -> row in the columns below
+        self._publisher = array("H")
+        self._domain = array("I")
+        self._cities = array("I")
+        self._category = array("I")
+        self._ad_count = array("q")
+        self._impressions = array("q")
+        self._placements = 0
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        for statement in SCHEMA:
+            self._connection.execute(statement)
+        self._connection.commit()
+
+    def add(self, publisher_id, domain, cities, neighborhoods, category, impressions, cached=False):
+        if cached:
+            return  # Served from the response cache, so an earlier run already merged this observation
+        key = (publisher_id, self._intern(domain), self._intern(tuple(cities)), self._intern(category))
+        row = self._rows.get(key)
+        if row is None:
+            self._rows[key] = len(self._ad_count)
+            self._publisher.append(publisher_id)
+            self._domain.append(key[1])
+            self._cities.append(key[2])
+            self._category.append(key[3])
+            self._ad_count.append(1)
+            self._impressions.append(impressions)
+        else:
+            self._ad_count[row] += 1
+            self._impressions[row] += impressions
+        self._placements += 1
+
+    def _intern(self, value):
+        label_id = self._labels.get(value)
+        if label_id is None:
+            label_id = self._labels[value] = len(self._label_values)
+            self._label_values.append(value)
+        return label_id
+
+    def _pending_rows(self):
+        """Yield the run's (day, publisher, domain, cities, category, ads, impressions) rows with labels resolved."""
+        labels = self._label_values
+        for publisher_id, domain, cities, category, ad_count, impressions in zip(
+            self._publisher, self._domain, self._cities, self._category, self._ad_count, self._impressions
+        ):
+            yield self.day, self.publishers[publisher_id], labels[domain], "-".join(labels[cities]), labels[category], ad_count, impressions
+
+    def merge(self):
+        """Upsert this run's pending counts into the daily table; returns False if the run was merged before."""
+        with self._connection:
+            cursor = self._connection.execute(
+                "INSERT OR IGNORE INTO runs (run_at, day, placements) VALUES (?, ?, ?)", (self.run_at, self.day, self._placements)
+            )
+            if cursor.rowcount == 0:
+                return False
+            self._connection.executemany(
+                """
+                INSERT INTO daily (day, publisher, domain, cities, category, ad_count, impression_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (day, publisher, domain, cities, category) DO UPDATE SET
+                    ad_count = ad_count + excluded.ad_count,
+                    impression_count = impression_count + excluded.impression_count
+                """,
+                self._pending_rows(),
+            )
+        self._rows = {}
+        for column in (self._publisher, self._domain, self._cities, self._category, self._ad_count, self._impressions):
+            del column[:]
+        return True
+
+    def publisher_shares(self, since=None, until=None, daily=False):
+        """Return (publisher, ads, impressions, ad share, impression share) rows over days since..until (ISO dates, inclusive).
+
+        With daily=True every row starts with its day and shares are within that day.
+        """
+        group_columns, partition = ("day, ", "day") if daily else ("", "1")
+        query = SHARES_QUERY.format(group_columns=group_columns, partition=partition)
+        return self._connection.execute(query, (since or "0000-00-00", until or "9999-99-99")).fetchall()
+
+    def domain_totals(self, since=None, until=None, publisher=None):
+        """Return (publisher, domain, ads, impressions) rows over a window, optionally for one publisher."""
+        query = """
+            SELECT publisher, domain, SUM(ad_count), SUM(impression_count)
+            FROM daily
+            WHERE day >= ? AND day <= ? AND (? IS NULL OR publisher = ?)
+            GROUP BY publisher, domain
+            ORDER BY publisher, SUM(ad_count) DESC
+        """
+        return self._connection.execute(query, (since or "0000-00-00", until or "9999-99-99", publisher, publisher)).fetchall()
+
+    def close(self):
+        """Close the database; counts not merged yet are dropped."""
+        self._connection.close()
+
+
+def print_publisher_shares(rows, daily=False):
+    for row in rows:
+        day, row = (f"{row[0]} ", row[1:]) if daily else ("", row)
+        publisher, ad_count, impression_count, ad_share, impression_share = row
+        print(f"{day}{publisher}: {ad_count} ads ({ad_share * 100:.2f}%), {impression_count} impressions ({(impression_share or 0) * 100:.2f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default=AGGREGATES_PATH)
+    parser.add_argument("--since", help="first day (YYYY-MM-DD) of the window")
+    parser.add_argument("--until", help="last day (YYYY-MM-DD) of the window")
+    parser.add_argument("--daily", action="store_true", help="shares per day instead of over the whole window")
+    args = parser.parse_args()
+
+    store = AggregateStore(path=args.path)
+    print_publisher_shares(store.publisher_shares(args.since, args.until, args.daily), args.daily)
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Benchmark each stage of the Divar pipeline offline against the replay mock server.
+
+    python bench_divar.py [archive.jsonl.gz]
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import divar
+from divar_replay import MockServer, load_archive, sample_archive
+from aggregate_store import AggregateStore
+from exporter import ResultExporter
+
+ROW_COUNT = 2000  # Rows in the generated input CSV, each with a distinct payload
+LATENCY = 0.02  # Mean seconds the mock server waits before answering
+JITTER = 0.005  # Standard deviation of that wait
+ERROR_RATE = 0.02  # Share of requests answered with 429/503 to exercise the retries
+CAPACITY = 150  # Requests/s the throttled mock answers before replying 429 with Retry-After
+
+
+def write_csv(path, row_count=ROW_COUNT):
+    with open(path, "w") as file:
+        file.write("cities,neighborhoods,category,count\n")
+        for i in range(row_count):
+            file.write(f"{i % 30 + 1},0,category-{i},{i * 7}\n")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def post_once(url, data):
+    try:
+        return requests.post(url, headers=divar.get_headers_with_random_cookie(), json=data).status_code == 200
+    except requests.exceptions.RequestException:
+        return False
+
+
+def unpooled_baseline(url, row_count):
+    """Send bare requests.post calls the way divar.py used to."""
+    data = {"city_ids": ["1"], "search_data": {"form_data": {"data": {"category": {"str": {"value": "x"}}}}}}
+    with ThreadPoolExecutor(max_workers=divar.MAX_WORKERS) as executor:
+        return sum(executor.map(post_once, [url] * row_count, [data] * row_count))
+
+
+def main():
+    responses = load_archive(sys.argv[1]) if len(sys.argv) > 1 else sample_archive()
+    server = MockServer(responses, LATENCY, JITTER, ERROR_RATE).start()
+    workdir = tempfile.mkdtemp()
+    try:
+        csv_path = os.path.join(workdir, "data.csv")
+        write_csv(csv_path)
+        print(f"{ROW_COUNT} rows, {len(responses)} recorded responses, latency {LATENCY * 1000:.0f}ms, error rate {ERROR_RATE:.0%}")
+
+        start = time.perf_counter()
+        ok = unpooled_baseline(server.url, ROW_COUNT)
+        elapsed = time.perf_counter() - start
+        print(f"search (unpooled baseline): {ROW_COUNT / elapsed:.0f} requests/s, {ok}/{ROW_COUNT} succeeded")
+
+        # Stage 1: network. Time every response through a session hook, retries included
+        latencies = []
+        session = divar.create_session()
+        session.hooks["response"].append(lambda response, *args, **kwargs: latencies.append(response.elapsed.total_seconds()))
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            links = list(divar.iter_links(divar.iter_csv_rows(csv_path), session=session, url=server.url))
+        elapsed = time.perf_counter() - start
+        print(
+            f"search: {len(latencies) / elapsed:.0f} requests/s, p50 {percentile(latencies, 0.5) * 1000:.1f}ms, "
+            f"p99 {percentile(latencies, 0.99) * 1000:.1f}ms, {len(links)}/{ROW_COUNT} rows answered"
+        )
+
+        # Stage 1b: network against an API that throttles; the limiter should settle just under its capacity
+        throttled_server = MockServer(responses, LATENCY, JITTER, capacity=CAPACITY).start()
+        limiter = divar.create_limiter()
+        start = time.perf_counter()
+        answered = sum(1 for _ in divar.iter_links(divar.iter_csv_rows(csv_path), url=throttled_server.url, limiter=limiter))
+        elapsed = time.perf_counter() - start
+        host_limit = limiter.host(throttled_server.url)
+        print(
+            f"search (capacity {CAPACITY}/s): {answered / elapsed:.0f} rows/s, {throttled_server.throttled} throttled, "
+            f"settled at concurrency {host_limit.limit:.0f}, rate {host_limit.rate:.0f}/s, {answered}/{ROW_COUNT} rows answered"
+        )
+        throttled_server.shutdown()
+
+        # Stage 2: decode
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            redirected = list(divar.iter_redirected_urls(links))
+        elapsed = time.perf_counter() - start
+        print(f"decode: {len(links) / elapsed:,.0f} links/s")
+
+        # Stage 3: classify and aggregate, into the same sinks divar.py writes
+        counts, totals = divar.new_aggregates()
+        exporter = ResultExporter(divar.CLASSIFIER.publishers, os.path.join(workdir, "placements.csv.gz"), os.path.join(workdir, "summary.csv"))
+        aggregates = AggregateStore(divar.CLASSIFIER.publishers, os.path.join(workdir, "aggregates.sqlite"), exporter.run_at)
+        store = divar.PlacementSinks(exporter, aggregates)
+        start = time.perf_counter()
+        for url, row_data in redirected:
+            divar.add_to_aggregates(counts, totals, url, row_data, store)
+        aggregates.merge()
+        store.close()
+        elapsed = time.perf_counter() - start
+        print(f"aggregate: {elapsed * 1000:.1f}ms for {len(redirected)} placements ({len(redirected) / elapsed:,.0f}/s)")
+    finally:
+        shutil.rmtree(workdir)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
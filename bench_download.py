@@ -0,0 +1,80 @@
+"""Measure download.py throughput against a local stand-in image server."""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import download
+from image_store import ImageStore
+
+IMAGE_COUNT = 200  # Number of images to serve
+IMAGE_SIZE = 256 * 1024  # Bytes per image
+LATENCY = 0.02  # Seconds the server waits before answering each request
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """Serve IMAGE_SIZE bytes for every GET after a fixed delay."""
+
+    protocol_version = "HTTP/1.1"
+    body = os.urandom(IMAGE_SIZE)
+
+    def do_GET(self):
+        time.sleep(LATENCY)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server():
+    """Start the stand-in server on a free port and return it."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serial_baseline(urls, folder):
+    """Download the way download.py used to: one fresh request per URL."""
+    os.makedirs(folder)
+    for index, url in enumerate(urls):
+        response = requests.get(url, headers=download.headers, stream=True)
+        with open(f"{folder}/image_{index}.jpeg", "wb") as handler:
+            handler.write(response.content)
+
+
+def report(name, elapsed):
+    total_mb = IMAGE_COUNT * IMAGE_SIZE / 1024 / 1024
+    print(f"{name}: {elapsed:.2f}s, {IMAGE_COUNT / elapsed:.1f} images/s, {total_mb / elapsed:.1f} MB/s")
+
+
+def main():
+    server = start_server()
+    host, port = server.server_address
+    urls = [f"http://{host}:{port}/photos/{i}/image.jpeg?w=500\n" for i in range(IMAGE_COUNT)]
+    workdir = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        serial_baseline([download.remove_query_params(url.strip()) for url in urls], f"{workdir}/serial")
+        report("serial", time.perf_counter() - start)
+
+        start = time.perf_counter()
+        stats = download.download_images(urls, f"{workdir}/pooled", store=ImageStore(f"{workdir}/.store"))
+        report(f"pooled ({download.MAX_WORKERS} workers)", time.perf_counter() - start)
+        assert stats["downloaded"] == IMAGE_COUNT, stats
+    finally:
+        shutil.rmtree(workdir)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
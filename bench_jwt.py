@@ -0,0 +1,65 @@
+"""Microbenchmark banner link decoding: the original parse_qs/json path against jwt_decoder."""
+
+import base64
+import json
+import random
+import re
+import time
+from urllib.parse import parse_qs, urlparse
+
+import jwt_decoder
+
+LINK_COUNT = 200000  # Banner links in the corpus
+CREATIVE_COUNT = 2000  # Distinct tokens among them; the same creative shows up across many placements
+SAMPLE_PATH = "divar_banner_sample.html"
+
+
+def build_corpus():
+    """Derive many distinct tokens from the recorded banner link and repeat them like real placements do."""
+    with open(SAMPLE_PATH, "r") as file:
+        link = re.search(r'href="(https://a-banners\.divar\.ir/[^"]+)"', file.read()).group(1)
+    base_url, token = link.split("ext_link_data=")
+    header, payload, signature = token.split(".")
+    claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+
+    links = []
+    for creative in range(CREATIVE_COUNT):
+        claims["adId"] = f"{creative:08d}-6b6a-40f2-92ae-eb7c0bfad872"
+        encoded = base64.urlsafe_b64encode(json.dumps(claims).encode()).rstrip(b"=").decode()
+        links.append(f"{base_url}ext_link_data={header}.{encoded}.{signature}")
+    random.seed(0)
+    return [random.choice(links) for _ in range(LINK_COUNT)]
+
+
+def original_decode(link):
+    """The decoding path divar.py used before jwt_decoder."""
+    query_params = parse_qs(urlparse(link).query)
+    header, payload, signature = query_params["ext_link_data"][0].split(".")
+    return json.loads(base64.urlsafe_b64decode(payload + "=="))
+
+
+def fast_decode(link):
+    return jwt_decoder.decode_jwt_payload(jwt_decoder.extract_ext_link_data(link))
+
+
+def measure(name, decode, corpus):
+    start = time.perf_counter()
+    for link in corpus:
+        decode(link)
+    elapsed = time.perf_counter() - start
+    print(f"{name}: {len(corpus) / elapsed:,.0f} links/s ({elapsed:.2f}s)")
+
+
+def main():
+    corpus = build_corpus()
+    assert all(original_decode(link) == fast_decode(link) for link in corpus[:1000])
+    print(f"{LINK_COUNT} links, {CREATIVE_COUNT} distinct tokens, JSON backend: {'orjson' if jwt_decoder.orjson else 'json'}")
+    measure("parse_qs + json", original_decode, corpus)
+    jwt_decoder.decode_jwt_payload.cache_clear()
+    measure("jwt_decoder (cold cache)", fast_decode, corpus)
+    measure("jwt_decoder (warm cache)", fast_decode, corpus)
+    print(jwt_decoder.decode_jwt_payload.cache_info())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Measure the browserless Pexels collector against locally served search pages."""
+
+import json
+import resource
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pexels_http
+
+KEYWORDS = ["Carpet", "Rugs", "Pictorial carpet", "Lamp", "Tool box"]
+PHOTOS_PER_PAGE = 24
+PAGE_PADDING = 300 * 1024  # Markup around the embedded data, roughly the size of a real result page
+
+
+def fixture_page(keyword, page):
+    """Build a search page shaped like the real one: results embedded in __NEXT_DATA__."""
+    photos = []
+    for i in range(PHOTOS_PER_PAGE):
+        photo_id = abs(hash(keyword)) % 1000000 * 1000 + page * PHOTOS_PER_PAGE + i
+        image = {
+            "small": f"https://images.pexels.com/photos/{photo_id}/pexels-photo-{photo_id}.jpeg?auto=compress&cs=tinysrgb&h=130",
+            "medium": f"https://images.pexels.com/photos/{photo_id}/pexels-photo-{photo_id}.jpeg?auto=compress&cs=tinysrgb&h=350",
+            "large": f"https://images.pexels.com/photos/{photo_id}/pexels-photo-{photo_id}.jpeg?auto=compress&cs=tinysrgb&h=650&w=940",
+        }
+        photos.append({"type": "photo", "attributes": {"id": photo_id, "alt": keyword, "image": image}})
+    data = {"props": {"pageProps": {"initialData": {"data": photos, "pagination": {"current_page": page}}}}}
+    padding = "<div class='filler'></div>" * (PAGE_PADDING // 26)
+    return f'<html><body>{padding}<script id="__NEXT_DATA__" type="application/json">{json.dumps(data)}</script></body></html>'
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        keyword = parsed.path.strip("/").split("/")[-1]
+        page = int(parse_qs(parsed.query).get("page", ["1"])[0])
+        body = fixture_page(keyword, page).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SearchHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://{server.server_address[0]}:{server.server_address[1]}"
+    session = pexels_http.create_session()
+
+    start = time.perf_counter()
+    for keyword in KEYWORDS:
+        keyword_start = time.perf_counter()
+        urls = pexels_http.collect_image_urls(session, keyword, 100, base)
+        assert len(urls) == 100, (keyword, len(urls))
+        print(f"{keyword}: {len(urls)} urls in {time.perf_counter() - keyword_start:.3f}s")
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{len(KEYWORDS) / elapsed:.1f} keywords/s, {elapsed / len(KEYWORDS):.3f}s per keyword, peak RSS {peak_mb:.0f} MB")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
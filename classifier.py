@@ -0,0 +1,72 @@
+import json
+import os
+from array import array
+from urllib.parse import urlparse
+
+PUBLISHERS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "publishers.json")
+
+
+def domain_of(url):
+    """Return the netloc of an absolute URL without a full urlparse."""
+    start = url.find("://")
+    if start == -1:
+        return urlparse(url).netloc
+    start += 3
+    end = len(url)
+    for separator in "/?#":
+        index = url.find(separator, start, end)
+        if index != -1:
+            end = index
+    return url[start:end]
+
+
+class BannerClassifier:
+    """Assign banner URLs to publishers using ordered substring rules.
+
+    A URL belongs to the first rule with a pattern anywhere in it
+    (case-insensitive), or to the default publisher. Rules are compiled into a
+    flat, priority-ordered list of (pattern, publisher id) pairs: with a handful
+    of patterns, CPython's substring search beats a combined regex several times over.
+    """
+
+    def __init__(self, rules, default):
+        self.publishers = list(dict.fromkeys([rule["publisher"] for rule in rules] + [default]))
+        self.default_id = self.publishers.index(default)
+        self._checks = tuple((pattern.lower(), self.publishers.index(rule["publisher"])) for rule in rules for pattern in rule["patterns"])
+
+    def classify_id(self, url):
+        """Return the index into self.publishers for one URL."""
+        url = url.lower()
+        for pattern, publisher_id in self._checks:
+            if pattern in url:
+                return publisher_id
+        return self.default_id
+
+    def classify(self, url):
+        return self.publishers[self.classify_id(url)]
+
+    def classify_batch(self, urls):
+        """Classify many URLs into columns: publisher ids as a compact array and domains as a list."""
+        publisher_ids = array("H", [self.classify_id(url) for url in urls])
+        domains = [domain_of(url) for url in urls]
+        return publisher_ids, domains
+
+
+def aggregate_by_domain(publisher_ids, domains, impressions):
+    """Group classified columns by (publisher id, domain) into [ad_count, impression_count] totals."""
+    totals = {}
+    for key, impression in zip(zip(publisher_ids, domains), impressions):
+        entry = totals.get(key)
+        if entry is None:
+            totals[key] = [1, impression]
+        else:
+            entry[0] += 1
+            entry[1] += impression
+    return totals
+
+
+def load_classifier(path=PUBLISHERS_PATH):
+    """Build a classifier from a publishers config file, so publishers can be added without code changes."""
+    with open(path, "r") as file:
+        config = json.load(file)
+    return BannerClassifier(config["rules"], config["default"])
@@ -1,11 +1,29 @@
 import csv
 import requests
 import uuid
-from urllib.parse import parse_qs, urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import base64
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import ExitStack, nullcontext
 import json
+import logging
+import time
+from itertools import islice
+
+from aggregate_store import AGGREGATES_PATH, AggregateStore
+from classifier import aggregate_by_domain, domain_of, load_classifier
+from divar_replay import ResponseRecorder
+from exporter import PLACEMENTS_PATH, SUMMARY_PATH, ResultExporter
+from jwt_decoder import decode_jwt_payload, extract_ext_link_data
+from metrics import Registry, Reporter
+from rate_limiter import AdaptiveLimiter
+from response_cache import ResponseCache, payload_key
+
+try:
+    import pandas as pd  # Optional: parses large CSV chunks much faster than csv.DictReader
+except ImportError:
+    pd = None
 
 # Constants
 URL = "https://api.divar.ir/v8/postlist/w/search"
@@ -28,8 +46,32 @@ HEADERS_TEMPLATE = {
 }
 
 CSV_FILE_PATH = "data.csv"  # Path to your CSV file
-MAX_ROWS = 100  # Limit the number of rows to process
-MAX_WORKERS = 35  # Number of threads for parallel execution
+MAX_ROWS = None  # Set a number to process only the first rows of the CSV
+CSV_BATCH_SIZE = 10000  # Rows parsed from the CSV at a time
+MAX_WORKERS = 35  # Number of threads for parallel execution; the adaptive limiter decides how many search at once
+MAX_RATE = None  # Optional ceiling in searches/s; the limiter lowers its own rate when the API throttles
+MAX_IN_FLIGHT = MAX_WORKERS * 2  # Requests queued ahead of the responses being processed
+REQUEST_TIMEOUT = 15  # Seconds to wait for a search response
+MAX_RETRIES = 3  # Retries for connection errors, 429 and 5xx responses
+BACKOFF_FACTOR = 0.5  # Retry delays grow as 0.5s, 1s, 2s, ... unless the server sends Retry-After
+POSTPROCESS_PROCESSES = 0  # Worker processes for decoding and classifying links; 0 does it in the main process
+POSTPROCESS_BATCH_SIZE = 2000  # Links sent to a worker process at a time
+RECORD_PATH = None  # Set to e.g. "responses.jsonl.gz" to capture search responses for divar_replay.py
+METRICS_PATH = "divar_metrics.prom"  # Prometheus text file rewritten while the run progresses
+LOG_LEVEL = logging.INFO  # DEBUG logs every request, link and decoded URL
+
+CLASSIFIER = load_classifier()  # Publisher rules from publishers.json
+
+log = logging.getLogger("divar")
+METRICS = Registry("divar_")
+REQUESTS = METRICS.counter("requests_total", "Search responses by status code", ["status"])
+REQUEST_SECONDS = METRICS.histogram("request_seconds", "Search request latency including retries")
+RESPONSE_BYTES = METRICS.counter("response_bytes_total", "Bytes of search response bodies")
+RETRIES = METRICS.counter("retries_total", "Search requests retried after a connection error, 429 or 5xx")
+IN_FLIGHT = METRICS.gauge("in_flight", "Search requests waiting for a response")
+ROWS = METRICS.counter("rows_total", "CSV rows by how their payload was answered", ["source"])
+LINKS = METRICS.counter("links_total", "Banner links by decode result", ["result"])
+STAGE_SECONDS = METRICS.histogram("stage_seconds", "Duration of each run stage", ["stage"], buckets=(1, 10, 60, 300, 1800, 3600, 14400))
 
 
 def get_headers_with_random_cookie():
@@ -40,62 +82,193 @@ def get_headers_with_random_cookie():
     return headers
 
 
-def extract_links_from_csv(csv_file_path, max_rows=MAX_ROWS):
-    """Extract links from the CSV file and return them as a list."""
-    extracted_links = []
-    request_count = 0  # Counter for the number of requests sent
+def create_session(pool_size=MAX_WORKERS):
+    """Create a session that keeps connections to the search API alive and retries transient failures."""
+    retry = Retry(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["POST"],  # Searches are read-only, so retrying the POST is safe
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def create_limiter(max_concurrency=MAX_WORKERS, max_rate=MAX_RATE):
+    """Create the limiter that adapts search concurrency and rate to the API's latency, errors and Retry-After."""
+    return AdaptiveLimiter(max_concurrency, max_rate=max_rate, metrics=METRICS)
+
+
+def search(session, data, url=URL, limiter=None):
+    """Send one search request with a fresh random cookie, recording its latency, status, size and retries."""
+    with limiter.slot(url) if limiter is not None else nullcontext():
+        start = time.perf_counter()
+        try:
+            response = session.post(url, headers=get_headers_with_random_cookie(), json=data, timeout=REQUEST_TIMEOUT)
+        except requests.exceptions.RequestException:
+            if limiter is not None:
+                limiter.observe(url, None, time.perf_counter() - start)
+            raise
+        elapsed = time.perf_counter() - start
+        REQUEST_SECONDS.observe(elapsed)
+        REQUESTS.inc(status=response.status_code)
+        RESPONSE_BYTES.inc(len(response.content))
+        retries = getattr(response.raw, "retries", None)
+        history = retries.history if retries is not None else ()
+        if history:
+            RETRIES.inc(len(history))
+        if limiter is not None:
+            # Attempts that urllib3 retried internally are throttling signals too; their back-off is not latency
+            for attempt in history:
+                limiter.observe(url, attempt.status, None)
+            limiter.observe(url, response.status_code, None if history else elapsed, response.headers.get("Retry-After"))
+    return response
+
+
+def build_search_request(row):
+    """Turn a CSV row into the search payload and the row data that travels with its result."""
+    city_ids = row["cities"].split("-")
+    neighborhoods = row["neighborhoods"].split("-") if row["neighborhoods"] != "0" else []
+    category = row["category"]
+
+    data = {
+        "city_ids": city_ids,
+        "search_data": {
+            "form_data": {
+                "data": {"category": {"str": {"value": category}}},
+            },
+            # "query": "قالیشویی",
+        },
+    }
+    row_data = {
+        "category": category,
+        "cities": city_ids,
+        "neighborhoods": neighborhoods,
+        "row_count": row["count"],
+    }
+    return data, row_data
+
+
+def iter_csv_batches(csv_file_path, batch_size=CSV_BATCH_SIZE, max_rows=MAX_ROWS):
+    """Yield the rows of the CSV file as lists of at most batch_size dicts."""
+    if pd is not None:
+        chunks = pd.read_csv(csv_file_path, dtype=str, keep_default_na=False, chunksize=batch_size, nrows=max_rows)
+        for chunk in chunks:
+            yield chunk.to_dict("records")
+        return
 
     with open(csv_file_path, mode="r") as file:
         reader = csv.DictReader(file)
-        tasks = {}
-
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            for i, row in enumerate(reader):
-                if i >= max_rows:
-                    break
+        if max_rows is not None:
+            reader = islice(reader, max_rows)
+        while True:
+            batch = list(islice(reader, batch_size))
+            if not batch:
+                break
+            yield batch
+
+
+def iter_csv_rows(csv_file_path, max_rows=MAX_ROWS):
+    """Yield rows of the CSV file one at a time, reading it in batches."""
+    for batch in iter_csv_batches(csv_file_path, max_rows=max_rows):
+        yield from batch
+
+
+def iter_links(rows, session=None, url=URL, max_in_flight=MAX_IN_FLIGHT, cache=None, recorder=None, limiter=None):
+    """Send a search per distinct payload and yield (link, row_data) for every row as responses arrive.
+
+    Rows whose payload is already in flight or answered reuse that response
+    instead of sending it again, and with a cache, payloads answered in an
+    earlier run are served from disk; their rows carry row_data["cached"], since
+    those banners were already observed then. A recorder captures every response for
+    offline replay. At most max_in_flight requests are pending
+    at a time, so rows are only read from the input as fast as the API answers;
+    the limiter decides how many of them are actually sent at once.
+    """
+    session = session or create_session()
+    limiter = limiter or create_limiter()
+    request_count = 0  # Counter for the number of requests sent
+    row_total = 0
+    rows = iter(rows)
+    pending = {}  # payload key -> row_data of every row waiting on that request
+    answered = {}  # payload key -> banner link (or None) from its response
+    cached = set()  # payload keys answered from the cache
 
-                city_ids = row["cities"].split("-")
-                neighborhoods = row["neighborhoods"].split("-") if row["neighborhoods"] != "0" else []
-                category = row["category"]
-
-                data = {
-                    "city_ids": city_ids,
-                    "search_data": {
-                        "form_data": {
-                            "data": {"category": {"str": {"value": category}}},
-                        },
-                        # "query": "قالیشویی",
-                    },
-                }
-
-                headers = get_headers_with_random_cookie()
-                future = executor.submit(requests.post, URL, headers=headers, json=data)
-                tasks[future] = {
-                    "category": category,
-                    "cities": city_ids,
-                    "neighborhoods": neighborhoods,
-                    "row_count": row["count"],
-                }
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        tasks = {}
+        while True:
+            for row in rows:
+                row_total += 1
+                data, row_data = build_search_request(row)
+                key = payload_key(data)
+                if key not in answered and key not in pending and cache is not None:
+                    body = cache.get(data)
+                    if body is not None:
+                        answered[key] = extract_inset_banner_link(json.loads(body))
+                        cached.add(key)
+                        row_data["cached"] = True
+                        ROWS.inc(source="cache")
+                        if answered[key]:
+                            yield answered[key], row_data
+                        continue
+                if key in answered or key in pending:
+                    ROWS.inc(source="shared")
+                    if key in cached:
+                        row_data["cached"] = True
+                    if key in pending:
+                        pending[key].append(row_data)
+                    elif answered[key]:
+                        yield answered[key], row_data
+                    continue
+                ROWS.inc(source="request")
+                pending[key] = [row_data]
+                tasks[executor.submit(search, session, data, url, limiter)] = key, data
                 request_count += 1
-                print(f"Request {request_count}: Sent to Divar API")  # Log the request count
-
-            count = 0
-            for future in as_completed(tasks):
-                row_data = tasks[future]
-                response = future.result()
-                count += 1
-                print(count)
+                log.debug("Request %d: Sent to Divar API", request_count)
+                if len(tasks) >= max_in_flight:
+                    break
+            IN_FLIGHT.set(len(tasks))
+            if not tasks:
+                break
+
+            done, _ = wait(tasks, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, data = tasks.pop(future)
+                waiting_rows = pending.pop(key)
+                try:
+                    response = future.result()
+                except requests.exceptions.RequestException as e:
+                    REQUESTS.inc(status="error")
+                    log.debug("Search failed: %s", e)  # Not cached, so a later row with this payload tries again
+                    continue
+                if recorder is not None:
+                    recorder.record(data, response.status_code, response.content)
                 if response.status_code == 200:
-                    response_json = response.json()
-                    link = extract_inset_banner_link(response_json)
+                    if cache is not None:
+                        cache.put(data, response.content)
+                    link = extract_inset_banner_link(response.json())
+                    answered[key] = link
                     if link:
-                        extracted_links.append((link, row_data))
-                        print(link)
+                        log.debug("Banner link: %s", link)
+                        for row_data in waiting_rows:
+                            yield link, row_data
                 else:
-                    print("fail", response.status_code)
+                    log.debug("Search failed: status code %d", response.status_code)
+            IN_FLIGHT.set(len(tasks))
 
-    print(f"Total requests sent: {request_count}")  # Print the total number of requests sent
-    return extracted_links
+    log.info("Total requests sent: %d for %d rows", request_count, row_total)
+    if cache is not None:
+        log.info(cache.summary())
+
+
+def extract_links_from_csv(csv_file_path, max_rows=MAX_ROWS, session=None, url=URL):
+    """Extract links from the CSV file and return them as a list."""
+    return list(iter_links(iter_csv_rows(csv_file_path, max_rows), session, url))
 
 
 def extract_inset_banner_link(response_json):
@@ -108,16 +281,7 @@ def extract_inset_banner_link(response_json):
 
 def decode_jwt_token(jwt_token):
     """Decode a JWT token without verification."""
-    try:
-        # JWT token consists of three parts: header, payload, and signature
-        header, payload, signature = jwt_token.split(".")
-
-        # Decode the payload (Base64 URL-safe decoding)
-        decoded_payload = base64.urlsafe_b64decode(payload + "==")  # Add padding '==' if needed
-        return json.loads(decoded_payload)
-    except Exception as e:
-        print(f"Error decoding JWT token: {e}")
-        return None
+    return decode_jwt_payload(jwt_token)
 
 
 def extract_redirected_url_from_token(token_payload):
@@ -138,123 +302,162 @@ def extract_redirected_url_from_token(token_payload):
     return redirected_url
 
 
-def get_redirected_urls(links):
-    """Extract and decode JWT tokens from Divar links to find redirected URLs."""
-    redirected_urls = []
+def decode_link(link):
+    """Return (result, redirected_url) for one Divar link; result is the links_total label, the URL is None unless decoded."""
+    # Extract the ext_link_data parameter (JWT token) from the URL
+    jwt_token = extract_ext_link_data(link)
+
+    if jwt_token:
+        # Decode the JWT token to get the payload
+        token_payload = decode_jwt_token(jwt_token)
+
+        if token_payload:
+            # Extract the redirected URL from the token's payload
+            redirected_url = extract_redirected_url_from_token(token_payload)
+            if redirected_url:
+                log.debug("Decoded redirected URL: %s", redirected_url)
+                return "decoded", redirected_url
+            log.debug("No redirected URL found in token payload")
+            return "no_url", None
+        log.debug("Failed to decode JWT token for link: %s", link)
+        return "undecodable", None
+    log.debug("No ext_link_data found in URL: %s", link)
+    return "no_token", None
 
+
+def iter_redirected_urls(links, results=None):
+    """Decode each (link, row_data) into (redirected_url, row_data) as it comes in.
+
+    Each link is counted in links_total, or in the results dict when one is given.
+    """
     for data in links:
-        link, row_data = data[0], data[1]
-        # Parse the URL and extract the ext_link_data parameter (JWT token)
-        parsed_url = urlparse(link)
-        query_params = parse_qs(parsed_url.query)
-
-        if "ext_link_data" in query_params:
-            jwt_token = query_params["ext_link_data"][0]
-
-            # Decode the JWT token to get the payload
-            token_payload = decode_jwt_token(jwt_token)
-
-            if token_payload:
-                # Extract the redirected URL from the token's payload
-                redirected_url = extract_redirected_url_from_token(token_payload)
-                if redirected_url:
-                    redirected_urls.append((redirected_url, row_data))
-                    print(f"Decoded redirected URL: {redirected_url}")
-                else:
-                    print("No redirected URL found in token payload")
-            else:
-                print(f"Failed to decode JWT token for link: {link}")
+        result, redirected_url = decode_link(data[0])
+        if results is None:
+            LINKS.inc(result=result)
         else:
-            print(f"No ext_link_data found in URL: {link}")
+            results[result] = results.get(result, 0) + 1
+        if redirected_url:
+            yield redirected_url, data[1]
 
-    return redirected_urls
 
+def get_redirected_urls(links):
+    """Extract and decode JWT tokens from Divar links to find redirected URLs."""
+    return list(iter_redirected_urls(links))
 
-def categorize_urls_and_aggregate(urls):
-    """Categorize URLs and aggregate them by domain."""
-    counts = {
-        "YEKTANET": defaultdict(lambda: {"ad_count": 0, "impression_count": 0, "placements": []}),
-        "tapsell": defaultdict(lambda: {"ad_count": 0, "impression_count": 0, "placements": []}),
-        "DAART": defaultdict(lambda: {"ad_count": 0, "impression_count": 0, "placements": []}),
-        "WITH UTM": defaultdict(lambda: {"ad_count": 0, "impression_count": 0, "placements": []}),
-        "WITHOUT UTM": defaultdict(lambda: {"ad_count": 0, "impression_count": 0, "placements": []}),
-    }
 
+def new_aggregates():
+    """Create empty per-publisher/domain counts and per-publisher totals."""
+    counts = {publisher: defaultdict(lambda: {"ad_count": 0, "impression_count": 0}) for publisher in CLASSIFIER.publishers}
     totals_per_publisher = defaultdict(lambda: {"ad_count": 0, "impression_count": 0})
+    return counts, totals_per_publisher
 
-    for data in urls:
-        url, row_data = data[0], data[1]
-        domain = urlparse(url).netloc
-        url = url.lower()
-        row_count = int(row_data["row_count"]) // 7
-        cities = row_data["cities"]
-        neighborhoods = row_data["neighborhoods"]
-        category = row_data["category"]
-
-        if "adivery" in url or "yektanet" in url:
-            counts["YEKTANET"][domain]["ad_count"] += 1
-            counts["YEKTANET"][domain]["impression_count"] += row_count
-            counts["YEKTANET"][domain]["placements"].append(
-                {
-                    "cities": cities,
-                    "neighborhoods": neighborhoods,
-                    "category": category,
-                }
-            )
-            totals_per_publisher["YEKTANET"]["ad_count"] += 1
-            totals_per_publisher["YEKTANET"]["impression_count"] += row_count
-        elif "tapsell" in url:
-            counts["tapsell"][domain]["ad_count"] += 1
-            counts["tapsell"][domain]["impression_count"] += row_count
-            counts["tapsell"][domain]["placements"].append(
-                {
-                    "cities": cities,
-                    "neighborhoods": neighborhoods,
-                    "category": category,
-                }
-            )
-            totals_per_publisher["tapsell"]["ad_count"] += 1
-            totals_per_publisher["tapsell"]["impression_count"] += row_count
-        elif "daart" in url:
-            counts["DAART"][domain]["ad_count"] += 1
-            counts["DAART"][domain]["impression_count"] += row_count
-            counts["DAART"][domain]["placements"].append(
-                {
-                    "cities": cities,
-                    "neighborhoods": neighborhoods,
-                    "category": category,
-                }
-            )
-            totals_per_publisher["DAART"]["ad_count"] += 1
-            totals_per_publisher["DAART"]["impression_count"] += row_count
-        elif "utm" not in url:
-            counts["WITHOUT UTM"][domain]["ad_count"] += 1
-            counts["WITHOUT UTM"][domain]["impression_count"] += row_count
-            counts["WITHOUT UTM"][domain]["placements"].append(
-                {
-                    "cities": cities,
-                    "neighborhoods": neighborhoods,
-                    "category": category,
-                }
-            )
-            totals_per_publisher["WITHOUT UTM"]["ad_count"] += 1
-            totals_per_publisher["WITHOUT UTM"]["impression_count"] += row_count
-        else:
-            counts["WITH UTM"][domain]["ad_count"] += 1
-            counts["WITH UTM"][domain]["impression_count"] += row_count
-            counts["WITH UTM"][domain]["placements"].append(
-                {
-                    "cities": cities,
-                    "neighborhoods": neighborhoods,
-                    "category": category,
-                }
-            )
-            totals_per_publisher["WITH UTM"]["ad_count"] += 1
-            totals_per_publisher["WITH UTM"]["impression_count"] += row_count
 
+def add_to_aggregates(counts, totals_per_publisher, url, row_data, store=None):
+    """Classify one redirected URL, add it to the running aggregates and record its placement; returns its publisher and domain."""
+    publisher_id = CLASSIFIER.classify_id(url)
+    publisher = CLASSIFIER.publishers[publisher_id]
+    domain = domain_of(url)
+    row_count = int(row_data["row_count"]) // 7
+
+    counts[publisher][domain]["ad_count"] += 1
+    counts[publisher][domain]["impression_count"] += row_count
+    totals_per_publisher[publisher]["ad_count"] += 1
+    totals_per_publisher[publisher]["impression_count"] += row_count
+    if store is not None:
+        store.add(publisher_id, domain, row_data["cities"], row_data["neighborhoods"], row_data["category"], row_count, row_data.get("cached", False))
+    return publisher, domain
+
+
+def categorize_urls_and_aggregate(urls, store=None):
+    """Categorize URLs and aggregate them by domain, recording each placement in store if given."""
+    urls = list(urls)
+    publisher_ids, domains = CLASSIFIER.classify_batch([data[0] for data in urls])
+    impressions = [int(data[1]["row_count"]) // 7 for data in urls]
+
+    counts, totals_per_publisher = new_aggregates()
+    for (publisher_id, domain), (ad_count, impression_count) in aggregate_by_domain(publisher_ids, domains, impressions).items():
+        publisher = CLASSIFIER.publishers[publisher_id]
+        counts[publisher][domain]["ad_count"] += ad_count
+        counts[publisher][domain]["impression_count"] += impression_count
+        totals_per_publisher[publisher]["ad_count"] += ad_count
+        totals_per_publisher[publisher]["impression_count"] += impression_count
+
+    if store is not None:
+        for publisher_id, domain, impression, data in zip(publisher_ids, domains, impressions, urls):
+            row_data = data[1]
+            store.add(publisher_id, domain, row_data["cities"], row_data["neighborhoods"], row_data["category"], impression, row_data.get("cached", False))
     return counts, totals_per_publisher
 
 
+def process_link_batch(links):
+    """Decode, classify and aggregate a batch of (link, row_data) pairs; runs in a worker process.
+
+    Returns plain, picklable partial results: {(publisher_id, domain): [ad_count, impression_count]},
+    the batch's placements as tuples ready for the placement store, and {result: links} for links_total.
+    """
+    results = {}
+    decoded = list(iter_redirected_urls(links, results))
+    publisher_ids, domains = CLASSIFIER.classify_batch([data[0] for data in decoded])
+    impressions = [int(data[1]["row_count"]) // 7 for data in decoded]
+    placements = [
+        (publisher_id, domain, row_data["cities"], row_data["neighborhoods"], row_data["category"], impression, row_data.get("cached", False))
+        for publisher_id, domain, impression, (_, row_data) in zip(publisher_ids, domains, impressions, decoded)
+    ]
+    return aggregate_by_domain(publisher_ids, domains, impressions), placements, results
+
+
+def merge_partial_results(counts, totals_per_publisher, partial, store=None):
+    """Fold one process_link_batch result into the final counts and totals."""
+    domain_totals, placements, _ = partial
+    for (publisher_id, domain), (ad_count, impression_count) in domain_totals.items():
+        publisher = CLASSIFIER.publishers[publisher_id]
+        counts[publisher][domain]["ad_count"] += ad_count
+        counts[publisher][domain]["impression_count"] += impression_count
+        totals_per_publisher[publisher]["ad_count"] += ad_count
+        totals_per_publisher[publisher]["impression_count"] += impression_count
+    if store is not None:
+        for placement in placements:
+            store.add(*placement)
+
+
+def postprocess_in_pool(links, counts, totals_per_publisher, store=None, processes=POSTPROCESS_PROCESSES, batch_size=POSTPROCESS_BATCH_SIZE):
+    """Decode and classify links in batches on a process pool while the network phase keeps producing them."""
+    links = iter(links)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        tasks = set()
+        while True:
+            batch = list(islice(links, batch_size))
+            if batch:
+                tasks.add(executor.submit(process_link_batch, batch))
+            # Keep a couple of batches per worker queued, merge whatever is finished
+            if tasks and (not batch or len(tasks) >= processes * 2):
+                done, _ = wait(tasks, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tasks.remove(future)
+                    partial = future.result()
+                    # Metrics recorded inside the workers stay there, so the batch brings its counts back
+                    for result, count in partial[2].items():
+                        LINKS.inc(count, result=result)
+                    merge_partial_results(counts, totals_per_publisher, partial, store)
+            if not batch and not tasks:
+                break
+
+
+class PlacementSinks:
+    """Forward every placement to several stores, e.g. the exporter and the cross-run aggregates."""
+
+    def __init__(self, *stores):
+        self.stores = stores
+
+    def add(self, *placement):
+        for store in self.stores:
+            store.add(*placement)
+
+    def close(self):
+        for store in self.stores:
+            store.close()
+
+
 def print_category_counts(category_counts, totals_per_publisher):
     """Print the counts for each category, domain, and total ads."""
     for category, domains in category_counts.items():
@@ -277,57 +480,50 @@ def print_category_counts(category_counts, totals_per_publisher):
         print(f"{publisher}: {data['impression_count'] / sum_impressions * 100:.2f}%")
 
 
-def save_category_counts_to_csv(category_counts, total_ads_per_publisher, csv_file_path):
-    """Save the counts for each category, domain, and total ads to a CSV file, with each placement on a separate row and without repeating the other columns' data."""
-    with open(csv_file_path, mode="w", newline="") as file:
-        writer = csv.writer(file)
-
-        # Write header for category counts
-        writer.writerow(["Category", "Domain", "Ad Count", "Impression Count", "City", "Neighborhood", "Category Placement"])
-
-        # Write category counts, separating each placement into a new row
-        for category, domains in category_counts.items():
-            for domain, count in domains.items():
-                ad_count = count["ad_count"]
-                impression_count = count["impression_count"]
-                placements = count["placements"]
-
-                # Write the first row with full data, then leave columns empty for subsequent placements
-                for idx, placement in enumerate(placements):
-                    cities = "-".join(placement["cities"])  # Convert list of cities to a single string
-                    neighborhoods = "-".join(placement["neighborhoods"])  # Convert list of neighborhoods to a single string
-                    category_placement = placement["category"]
-
-                    if idx == 0:
-                        # First row: full data
-                        writer.writerow([category, domain, ad_count, impression_count, cities, neighborhoods, category_placement])
-                    else:
-                        # Subsequent rows: leave all but placement-specific columns empty
-                        writer.writerow(
-                            [
-                                "",
-                                "",
-                                "",
-                                "",  # Empty columns for category, domain, ad count, impression count
-                                cities,
-                                neighborhoods,
-                                category_placement,
-                            ]
-                        )
-
-        # Write total ads per publisher
-        writer.writerow([])
-        writer.writerow(["Publisher", "Total Ads Count"])
-        for publisher, count in total_ads_per_publisher.items():
-            writer.writerow([publisher, count])
-
-
-def main():
-    links = extract_links_from_csv(CSV_FILE_PATH)  # Get total_ads from CSV
-    redirected_urls = get_redirected_urls(links)
-    category_counts, total_ads_per_publisher = categorize_urls_and_aggregate(redirected_urls)
-    print_category_counts(category_counts, total_ads_per_publisher)
-    save_category_counts_to_csv(category_counts, total_ads_per_publisher, "output_results.csv")
+def main(
+    csv_file_path=CSV_FILE_PATH,
+    url=URL,
+    use_cache=True,
+    record_path=RECORD_PATH,
+    metrics_path=METRICS_PATH,
+    placements_path=PLACEMENTS_PATH,
+    summary_path=SUMMARY_PATH,
+    aggregates_path=AGGREGATES_PATH,
+):
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    counts, total_ads_per_publisher = new_aggregates()
+    with ExitStack() as stack:
+        # Placements are appended to the long-format output as they are classified, not held until the end,
+        # and this run's counts are merged into the per-day aggregates kept across runs once it succeeds.
+        # Every output is closed even if the run fails, so what was collected up to then stays readable
+        exporter = ResultExporter(CLASSIFIER.publishers, placements_path, summary_path)
+        stack.callback(exporter.close)
+        aggregates = AggregateStore(CLASSIFIER.publishers, aggregates_path, exporter.run_at)
+        stack.callback(aggregates.close)
+        store = PlacementSinks(exporter, aggregates)
+        recorder = ResponseRecorder(record_path) if record_path else None
+        if recorder is not None:
+            stack.callback(recorder.close)
+        cache = ResponseCache() if use_cache else None
+        if cache is not None:
+            stack.callback(cache.close)
+        stack.enter_context(Reporter(METRICS, metrics_path, logger=log))
+
+        # Each response is decoded, classified and recorded as soon as it arrives
+        links = iter_links(iter_csv_rows(csv_file_path), url=url, cache=cache, recorder=recorder)
+        with STAGE_SECONDS.time(stage="collect"):
+            if POSTPROCESS_PROCESSES > 0:
+                postprocess_in_pool(links, counts, total_ads_per_publisher, store)
+            else:
+                for redirected_url, row_data in iter_redirected_urls(links):
+                    add_to_aggregates(counts, total_ads_per_publisher, redirected_url, row_data, store)
+
+        with STAGE_SECONDS.time(stage="report"):
+            print_category_counts(counts, total_ads_per_publisher)
+            exporter.write_summary(counts)
+        aggregates.merge()
+    log.info("Appended %d placements to %s and the per-domain summary to %s", exporter.rows, placements_path, summary_path)
+    log.info("Merged this run into %s; query shares over time with aggregate_store.py", aggregates_path)
 
 
 if __name__ == "__main__":
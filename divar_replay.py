@@ -0,0 +1,191 @@
+"""Record Divar search responses and replay them from a local mock server.
+
+    python divar_replay.py serve responses.jsonl.gz --latency 0.05 --error-rate 0.02
+    python divar_replay.py run responses.jsonl.gz --csv data.csv
+    python divar_replay.py run responses.jsonl.gz --output-dir replay_outputs  # keep the replayed outputs
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from exporter import open_append, open_read
+from response_cache import payload_key
+
+SAMPLE_PATH = "divar_banner_sample.html"
+
+
+class ResponseRecorder:
+    """Append search responses to a JSON-lines archive, one line per distinct payload.
+
+    The archive is compressed by its extension (.gz or .zst, plain otherwise),
+    as load_archive reads it. The responses only reach the archive on close(),
+    so an interrupted run leaves it readable.
+    """
+
+    def __init__(self, path):
+        self._file = open_append(path)
+        self._lock = threading.Lock()
+        self._seen = set()
+
+    def record(self, data, status, body):
+        key = payload_key(data)
+        with self._lock:
+            if key in self._seen:
+                return
+            self._seen.add(key)
+            self._file.write(json.dumps({"key": key, "status": status, "body": body.decode("utf-8")}) + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def load_archive(path):
+    """Return {payload key: (status, body bytes)} from a recorded archive."""
+    responses = {}
+    with open_read(path) as file:
+        for line in file:
+            entry = json.loads(line)
+            responses[entry["key"]] = (entry["status"], entry["body"].encode("utf-8"))
+    return responses
+
+
+def sample_archive():
+    """Build a one-response archive around the banner link saved in divar_banner_sample.html."""
+    with open(SAMPLE_PATH, "r") as file:
+        link = re.search(r'href="(https://a-banners\.divar\.ir/[^"]+)"', file.read()).group(1)
+    widget = {"widget_type": "INSET_BANNER", "data": {"action": {"payload": {"link": link}}}}
+    return {"sample": (200, json.dumps({"list_top_widgets": [widget]}).encode())}
+
+
+class MockServer(ThreadingHTTPServer):
+    """Serve recorded responses for the search endpoint with configurable latency and error rate.
+
+    A payload that was recorded gets its own response back; any other payload
+    gets one of the recorded 200 responses, so arbitrary CSVs can be replayed.
+    With a capacity, requests beyond that many per second are rejected with
+    429 and Retry-After, like a rate-limited API.
+    """
+
+    daemon_threads = True
+    request_queue_size = 256  # The default backlog of 5 resets bursts of new connections
+
+    def __init__(self, responses, latency=0.0, jitter=0.0, error_rate=0.0, address=("127.0.0.1", 0), capacity=None):
+        super().__init__(address, MockHandler)
+        self.responses = responses
+        self.fallback = [response for response in responses.values() if response[0] == 200] or list(responses.values())
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.capacity = capacity
+        self.throttled = 0
+        self._second = None
+        self._second_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/v8/postlist/w/search"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def over_capacity(self):
+        """Count a request against the current second and tell whether it exceeds the capacity."""
+        if not self.capacity:
+            return False
+        with self._lock:
+            second = int(time.monotonic())
+            if second != self._second:
+                self._second, self._second_count = second, 0
+            self._second_count += 1
+            if self._second_count <= self.capacity:
+                return False
+            self.throttled += 1
+            return True
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # Headers and body are separate writes; Nagle would hold the body for a delayed ACK
+
+    def do_POST(self):
+        server = self.server
+        data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+        if server.over_capacity():
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        time.sleep(max(0.0, random.gauss(server.latency, server.jitter)) if server.jitter else server.latency)
+        if random.random() < server.error_rate:
+            status, body = random.choice([429, 503]), b""
+        else:
+            status, body = server.responses.get(payload_key(data)) or random.choice(server.fallback)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["serve", "run"], help="serve the archive, or run divar.py against it offline")
+    parser.add_argument("archive", nargs="?", help="recorded archive; defaults to the saved banner sample")
+    parser.add_argument("--csv", default="data.csv", help="input CSV for the run command")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean seconds before each response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="standard deviation of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 429/503")
+    parser.add_argument("--capacity", type=int, help="requests per second answered before 429 with Retry-After")
+    parser.add_argument("--output-dir", help="where the run command writes its outputs; defaults to a temporary directory removed afterwards")
+    args = parser.parse_args()
+
+    responses = load_archive(args.archive) if args.archive else sample_archive()
+    server = MockServer(responses, args.latency, args.jitter, args.error_rate, ("127.0.0.1", args.port), args.capacity).start()
+    print(f"Serving {len(responses)} recorded responses at {server.url}")
+
+    if args.command == "run":
+        import divar
+
+        # Replay must not be answered from the live cache, nor write mock traffic into the real outputs and aggregates
+        output_dir = args.output_dir or tempfile.mkdtemp()
+        os.makedirs(output_dir, exist_ok=True)
+        try:
+            divar.main(
+                csv_file_path=args.csv,
+                url=server.url,
+                use_cache=False,
+                metrics_path=os.path.join(output_dir, "divar_metrics.prom"),
+                placements_path=os.path.join(output_dir, "output_placements.csv.gz"),
+                summary_path=os.path.join(output_dir, "output_summary.csv"),
+                aggregates_path=os.path.join(output_dir, "divar_aggregates.sqlite"),
+            )
+        finally:
+            server.shutdown()
+            if not args.output_dir:
+                shutil.rmtree(output_dir)
+    else:
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
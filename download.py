@@ -1,7 +1,17 @@
+import hashlib
+import logging
 import os
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from urllib.parse import urlparse, urlunparse
 
+from image_store import ImageStore
+from manifest import CrawlManifest
+from metrics import Registry, Reporter
+from rate_limiter import AdaptiveLimiter
+
 # Headers for downloading images
 headers = {
     "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
@@ -9,6 +19,28 @@ headers = {
     "user-agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36",
 }
 
+URL_DIR = "pexels_image_urls"  # Directory containing URL files
+IMAGES_DIR = "pexels_images"  # Directory to save images into
+MAX_WORKERS = 16  # Number of threads downloading in parallel
+MAX_IN_FLIGHT = 16  # Global cap on requests in flight
+MAX_PER_HOST = 8  # Ceiling for the adaptive per-host concurrency limit
+REQUEST_TIMEOUT = 30  # Seconds to wait for a server response
+CHUNK_SIZE = 64 * 1024  # Bytes read from the socket per write
+MAX_ATTEMPTS = 5  # Give up on a URL after this many failed requests in a row
+REVALIDATE = False  # Send conditional GETs for images that are already stored
+METRICS_PATH = "download_metrics.prom"  # Prometheus text file rewritten while downloads run
+LOG_LEVEL = logging.INFO  # DEBUG logs every downloaded image
+
+log = logging.getLogger("download")
+METRICS = Registry("download_")
+REQUESTS = METRICS.counter("requests_total", "Image responses by status code", ["status"])
+REQUEST_SECONDS = METRICS.histogram("request_seconds", "Time from sending a request to the last body byte")
+BYTES = METRICS.counter("bytes_total", "Image bytes written to the store")
+IMAGES = METRICS.counter("images_total", "Image paths by outcome", ["result"])
+IN_FLIGHT = METRICS.gauge("in_flight", "Image requests holding a connection slot")
+QUEUED = METRICS.gauge("queued", "Image downloads submitted but not finished")
+STAGE_SECONDS = METRICS.histogram("stage_seconds", "Duration of each run stage", ["stage"], buckets=(1, 10, 60, 300, 1800, 3600, 14400))
+
 
 # Function to remove query parameters from a URL
 def remove_query_params(url):
@@ -17,38 +49,206 @@ def remove_query_params(url):
     return url_without_query
 
 
-# Function to download images from a list of URLs
-def download_images(urls, folder):
+# Function to create a session that keeps connections alive between downloads
+def create_session(max_per_host=MAX_PER_HOST):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_per_host, pool_block=True)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(headers)
+    return session
+
+
+# Function to create the limiter that adapts each host's concurrency and request rate to its responses
+def create_limiter(max_in_flight=MAX_IN_FLIGHT, max_per_host=MAX_PER_HOST):
+    return AdaptiveLimiter(max_per_host, max_in_flight, metrics=METRICS)
+
+
+# Function to copy a response body to path in chunks, returning the number of bytes written and their sha256
+def stream_to_file(response, path):
+    # Content-Length counts encoded bytes, so it can only be checked for identity bodies
+    expected = None if "Content-Encoding" in response.headers else response.headers.get("Content-Length")
+    temp_path = f"{path}.part"
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        with open(temp_path, "wb") as handler:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                handler.write(chunk)
+                digest.update(chunk)
+                written += len(chunk)
+        if expected is not None and written != int(expected):
+            raise IOError(f"truncated body: got {written} of {expected} bytes")
+        os.replace(temp_path, path)  # Only complete files ever get the final name
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return written, digest.hexdigest()
+
+
+# Function to download a single image into the store and link it to every image path that wants it
+def download_image(session, limiter, store, manifest, url, image_paths, row=None):
+    # Revalidate a stored copy with a conditional GET instead of fetching it again
+    request_headers = {}
+    if row and row["etag"]:
+        request_headers["If-None-Match"] = row["etag"]
+    if row and row["last_modified"]:
+        request_headers["If-Modified-Since"] = row["last_modified"]
+
+    temp_path = store.temp_path()
+    with limiter.slot(url):
+        IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            response = session.get(url, headers=request_headers, stream=True, timeout=REQUEST_TIMEOUT)
+        except requests.exceptions.RequestException:
+            limiter.observe(url, None, time.perf_counter() - start)
+            IN_FLIGHT.dec()
+            raise
+        REQUESTS.inc(status=response.status_code)
+        # Time to the response headers is what grows when the host is overloaded; the body is bandwidth
+        limiter.observe(url, response.status_code, time.perf_counter() - start, response.headers.get("Retry-After"))
+        try:
+            if response.status_code == 304 and row:
+                manifest.record_not_modified(url)
+                object_path, size, status = store.object_path(row["sha256"]), 0, "not_modified"
+            elif response.status_code != 200:
+                log.debug("Failed to download %s from %s: Status code %d", image_paths[0], url, response.status_code)
+                manifest.record_failure(url)
+                return "failed", 0
+            else:
+                size, digest = stream_to_file(response, temp_path)
+                object_path, status = store.add(temp_path, digest), "downloaded"
+                manifest.record_success(url, size, digest, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+                BYTES.inc(size)
+                log.debug("Downloaded %s from %s", image_paths[0], url)
+        finally:
+            response.close()
+            REQUEST_SECONDS.observe(time.perf_counter() - start)
+            IN_FLIGHT.dec()
+    for image_path in image_paths:
+        store.link(object_path, image_path)
+    return status, size
+
+
+# Function to split jobs into URLs still to download and paths that only need linking to an already stored image
+def plan_downloads(jobs, store, manifest, stats, revalidate=REVALIDATE):
+    # Group paths by URL so a photo shared by several keywords is fetched once
+    jobs = list(jobs)
+    rows = manifest.rows(url for url, _ in jobs)
+    excluded = manifest.excluded()
+    pending = {}
+    stored = {}
+    for url, image_path in jobs:
+        row = rows.get(url)
+        if row and (os.path.basename(os.path.dirname(image_path)), row["sha256"]) in excluded:
+            stats["skipped"] += 1  # Pruned from this folder, e.g. as a near-duplicate
+            IMAGES.inc(result="skipped")
+            continue
+        if row and row["status"] == "done" and store.has(row["sha256"]):
+            if not revalidate:  # Already fetched, only make sure this path points at it
+                result = "linked" if store.link(store.object_path(row["sha256"]), image_path) else "skipped"
+                stats[result] += 1
+                IMAGES.inc(result=result)
+                continue
+            stored[url] = row
+        elif row and row["attempts"] >= MAX_ATTEMPTS:  # Also a done row whose stored copy is gone and cannot be fetched again
+            stats["failed"] += 1
+            IMAGES.inc(result="failed")
+            continue
+        pending.setdefault(url, []).append(image_path)
+    return pending, stored
+
+
+# Function to count a finished download_image future into stats
+def record_download(future, manifest, url, image_paths, stats):
+    try:
+        status, size = future.result()
+    except Exception as e:
+        log.debug("Could not download %s from %s: %s", image_paths[0], url, e)
+        REQUESTS.inc(status="error")
+        manifest.record_failure(url)
+        status, size = "failed", 0
+    if status == "failed":
+        stats["failed"] += len(image_paths)
+        IMAGES.inc(len(image_paths), result="failed")
+        return status
+    stats[status] += 1
+    stats["linked"] += len(image_paths) - 1
+    stats["bytes"] += size
+    IMAGES.inc(result=status)
+    IMAGES.inc(len(image_paths) - 1, result="linked")
+    return status
+
+
+# Function to return empty download counters
+def new_stats():
+    return {"downloaded": 0, "not_modified": 0, "linked": 0, "skipped": 0, "failed": 0, "bytes": 0}
+
+
+# Function to download (url, image_path) jobs concurrently with a bounded worker pool
+def download_jobs(jobs, session=None, limiter=None, store=None, manifest=None, max_workers=MAX_WORKERS, revalidate=REVALIDATE):
+    session = session or create_session()
+    limiter = limiter or create_limiter()
+    store = store or ImageStore()
+    manifest = manifest or CrawlManifest(os.path.join(store.root, "manifest.sqlite"))
+    stats = new_stats()
+    pending, stored = plan_downloads(jobs, store, manifest, stats, revalidate)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        tasks = {}
+        for url, image_paths in pending.items():
+            future = executor.submit(download_image, session, limiter, store, manifest, url, image_paths, stored.get(url))
+            tasks[future] = (url, image_paths)
+        QUEUED.inc(len(tasks))
+
+        for future in as_completed(tasks):
+            url, image_paths = tasks[future]
+            QUEUED.dec()
+            record_download(future, manifest, url, image_paths, stats)
+
+    return stats
+
+
+# Function to turn a list of URLs into download jobs for one folder
+def build_jobs(urls, folder):
     if not os.path.exists(folder):
         os.makedirs(folder)
+    jobs = []
     for index, url in enumerate(urls):
         url = url.strip()  # Remove any extra whitespace/newlines
         if url:
-            url = remove_query_params(url)
-            image_path = f"{folder}/image_{index}.jpeg"
-            if not os.path.exists(image_path):  # Check if image already exists
-                try:
-                    response = requests.get(url, headers=headers, stream=True)
-                    if response.status_code == 200:
-                        with open(image_path, "wb") as handler:
-                            handler.write(response.content)
-                        print(f"Downloaded image_{index}.jpeg from {url}")
-                    else:
-                        print(f"Failed to download image_{index}.jpeg from {url}: Status code {response.status_code}")
-                except Exception as e:
-                    print(f"Could not download image_{index}.jpeg from {url}: {e}")
-            else:
-                print(f"Image {image_path} already exists, skipping download.")
+            jobs.append((remove_query_params(url), f"{folder}/image_{index}.jpeg"))
+    return jobs
+
+
+# Function to download images from a list of URLs
+def download_images(urls, folder, session=None, limiter=None, store=None, manifest=None, max_workers=MAX_WORKERS):
+    return download_jobs(build_jobs(urls, folder), session, limiter, store, manifest, max_workers)
+
+
+# Function to download the images of every keyword file in url_dir through one shared pool
+def download_all(url_dir=URL_DIR, images_dir=IMAGES_DIR, max_workers=MAX_WORKERS, revalidate=REVALIDATE):
+    jobs = []
+    for filename in os.listdir(url_dir):
+        if filename.endswith(".txt"):
+            keyword = filename.replace("_", " ").replace(".txt", "")
+            folder_name = f"{images_dir}/{keyword.replace(' ', '_')}"
+            with open(os.path.join(url_dir, filename), "r") as file:
+                jobs.extend(build_jobs(file.readlines(), folder_name))
+    return download_jobs(jobs, store=ImageStore(f"{images_dir}/.store"), max_workers=max_workers, revalidate=revalidate)
+
 
+def main(metrics_path=METRICS_PATH):
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    with Reporter(METRICS, metrics_path, logger=log), STAGE_SECONDS.time(stage="download"):
+        stats = download_all()
+    print(
+        f"Downloaded {stats['downloaded']} images ({stats['bytes']} bytes), {stats['not_modified']} not modified, "
+        f"linked {stats['linked']}, already in place {stats['skipped']}, failed {stats['failed']}"
+    )
 
-# Directory containing URL files
-url_dir = "pexels_image_urls"
 
-# Iterate over each file in the directory
-for filename in os.listdir(url_dir):
-    if filename.endswith(".txt"):
-        keyword = filename.replace("_", " ").replace(".txt", "")
-        folder_name = f"pexels_images/{keyword.replace(' ', '_')}"
-        with open(os.path.join(url_dir, filename), "r") as file:
-            image_urls = file.readlines()
-            download_images(image_urls, folder_name)
+if __name__ == "__main__":
+    main()
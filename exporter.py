@@ -0,0 +1,146 @@
+import csv
+import gzip
+import json
+import os
+import shutil
+from datetime import datetime
+
+try:
+    import zstandard  # Optional: .zst outputs
+except ImportError:
+    zstandard = None
+
+PLACEMENTS_PATH = "output_placements.csv.gz"
+SUMMARY_PATH = "output_summary.csv"
+PLACEMENT_FIELDS = ["run_at", "publisher", "domain", "cities", "neighborhoods", "category", "impressions"]
+SUMMARY_FIELDS = ["run_at", "publisher", "domain", "ad_count", "impression_count", "ad_share", "impression_share"]
+
+
+def open_append(path):
+    """Open path for appending text, compressed by its extension (.gz or .zst).
+
+    Both formats allow appending: each run adds a gzip member or zstd frame,
+    and readers decompress the concatenation as one stream. Compressed text
+    goes to a side file first and is only appended on close, so a run that
+    crashes cannot leave a truncated member that makes the whole file unreadable.
+    """
+    if path.endswith(".gz"):
+        return CompressedAppender(path, gzip.open)
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"{path}: writing .zst files needs the zstandard package")
+        return CompressedAppender(path, zstandard.open)
+    return open(path, "a", encoding="utf-8", newline="")
+
+
+def open_read(path):
+    """Open a file written by open_append for reading text, decompressed by its extension."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"{path}: reading .zst files needs the zstandard package")
+        return zstandard.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+
+class CompressedAppender:
+    """Write one run's text to a compressed path.part and append it to path as a single member on close."""
+
+    def __init__(self, path, opener):
+        self.path = path
+        self.part_path = f"{path}.part"  # Left over only by a run that crashed, and overwritten by the next one
+        self._file = opener(self.part_path, "wt", encoding="utf-8", newline="")
+
+    def write(self, text):
+        return self._file.write(text)
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        with open(self.part_path, "rb") as part, open(self.path, "ab") as file:
+            shutil.copyfileobj(part, file)
+        os.remove(self.part_path)
+
+
+def data_format(path):
+    """Return "csv" or "jsonl" from a path such as output.jsonl.gz."""
+    name = path[: -len(".gz")] if path.endswith(".gz") else path[: -len(".zst")] if path.endswith(".zst") else path
+    extension = os.path.splitext(name)[1].lstrip(".")
+    if extension not in ("csv", "jsonl"):
+        raise ValueError(f"{path}: unsupported output format {extension!r}, use .csv or .jsonl")
+    return extension
+
+
+class RowWriter:
+    """Append dict rows with fixed fields to a CSV or JSON-lines file, optionally compressed.
+
+    A CSV header is only written when the file is new, so runs append to one table.
+    """
+
+    def __init__(self, path, fields):
+        self.path = path
+        self.fields = fields
+        self.format = data_format(path)
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open_append(path)
+        if self.format == "csv":
+            self._writer = csv.writer(self._file)
+            if is_new:
+                self._writer.writerow(fields)
+
+    def write(self, values):
+        """Write one row given as a sequence in field order."""
+        if self.format == "csv":
+            self._writer.writerow(values)
+        else:
+            self._file.write(json.dumps(dict(zip(self.fields, values)), ensure_ascii=False) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class ResultExporter:
+    """Stream each classified placement to a long-format table and write a per-domain summary at the end.
+
+    Every row is stamped with the run's start time, so outputs from many runs
+    can be appended to the same files and told apart. add() takes the
+    placements add_to_aggregates() classifies, like AggregateStore.add.
+    """
+
+    def __init__(self, publishers, placements_path=PLACEMENTS_PATH, summary_path=SUMMARY_PATH, run_at=None):
+        self.publishers = publishers
+        self.summary_path = summary_path
+        self.run_at = run_at or datetime.now().isoformat(timespec="milliseconds")
+        self.rows = 0
+        self._placements = RowWriter(placements_path, PLACEMENT_FIELDS)
+
+    def add(self, publisher_id, domain, cities, neighborhoods, category, impressions, cached=False):
+        self._placements.write([self.run_at, self.publishers[publisher_id], domain, "-".join(cities), "-".join(neighborhoods), category, impressions])
+        self.rows += 1
+
+    def write_summary(self, category_counts):
+        """Append one row per (publisher, domain) with its counts and its share of this run's ads and impressions."""
+        sum_ads = sum(data["ad_count"] for domains in category_counts.values() for data in domains.values())
+        sum_impressions = sum(data["impression_count"] for domains in category_counts.values() for data in domains.values())
+        writer = RowWriter(self.summary_path, SUMMARY_FIELDS)
+        try:
+            for publisher, domains in category_counts.items():
+                for domain, data in sorted(domains.items()):
+                    writer.write(
+                        [
+                            self.run_at,
+                            publisher,
+                            domain,
+                            data["ad_count"],
+                            data["impression_count"],
+                            round(data["ad_count"] / sum_ads, 6) if sum_ads else 0,
+                            round(data["impression_count"] / sum_impressions, 6) if sum_impressions else 0,
+                        ]
+                    )
+        finally:
+            writer.close()
+
+    def close(self):
+        self._placements.close()
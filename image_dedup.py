@@ -0,0 +1,294 @@
+"""Find visually near-duplicate images across keyword folders with perceptual hashes.
+
+    python image_dedup.py report                     # list groups of near-duplicates
+    python image_dedup.py report --hash dhash --threshold 6
+    python image_dedup.py prune                      # keep one image per group within each keyword folder
+    python image_dedup.py report --scope keyword     # only group images that share a keyword folder
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from image_verify import iter_image_paths
+from manifest import CrawlManifest
+
+IMAGES_DIR = "pexels_images"  # Keyword folders written by download.py
+STORE_DIR = "pexels_images/.store"  # Content-addressed store the keyword folders link into
+HASHES_PATH = "pexels_images/.phash.npz"  # Hashes of every image, with the size and mtime they were computed for
+PROCESSES = os.cpu_count() or 4  # Worker processes decoding images
+CHUNK_SIZE = 32  # Images per task sent to a worker
+HASH_NAMES = ("ahash", "dhash", "phash")  # Columns of the hash array
+HASH = "phash"  # Hash compared by default
+THRESHOLD = 4  # Largest Hamming distance, out of 64 bits, still counted as a near-duplicate
+BLOCK_ELEMENTS = 1 << 24  # Distances the brute-force search computes at once, which bounds its memory
+LOG_LEVEL = logging.INFO
+
+log = logging.getLogger("image_dedup")
+
+# Orthonormal DCT-II basis for the 32x32 pHash reduction
+_N = 32
+DCT_MATRIX = np.sqrt(2 / _N) * np.cos(np.pi * (2 * np.arange(_N)[None, :] + 1) * np.arange(_N)[:, None] / (2 * _N))
+DCT_MATRIX[0] /= np.sqrt(2)
+
+# Set bits per byte, for numpy versions without bitwise_count
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def pack_bits(bits):
+    """Pack 64 booleans, most significant first, into one unsigned 64-bit integer."""
+    return int(np.packbits(bits.ravel()).view(">u8")[0])
+
+
+def grayscale(image, size):
+    return np.asarray(image.convert("L").resize(size, Image.LANCZOS), dtype=np.float64)
+
+
+def image_hashes(image):
+    """Return the (aHash, dHash, pHash) of a PIL image as 64-bit integers."""
+    pixels = grayscale(image, (8, 8))
+    ahash = pack_bits(pixels > pixels.mean())
+    pixels = grayscale(image, (9, 8))
+    dhash = pack_bits(pixels[:, 1:] > pixels[:, :-1])
+    low = (DCT_MATRIX @ grayscale(image, (32, 32)) @ DCT_MATRIX.T)[:8, :8]
+    phash = pack_bits(low > np.median(low.ravel()[1:]))  # The DC term only reflects overall brightness
+    return ahash, dhash, phash
+
+
+def hash_file(path):
+    """Return the hashes of the image at path, or None if it cannot be decoded."""
+    try:
+        with Image.open(path) as image:
+            return image_hashes(image)
+    except Exception as e:  # Corrupt files are image_verify.py's job, they just get no hash here
+        log.debug("Could not hash %s: %s", path, e)
+        return None
+
+
+def popcount(values):
+    """Count the set bits of every element of a uint64 array."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _POPCOUNT[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+
+class HashIndex:
+    """Perceptual hashes of every image under images_dir, kept in one packed uint64 array.
+
+    paths[i] has hashes[i] = (aHash, dHash, pHash). update() only decodes
+    paths whose size or mtime changed since the saved index, and paths that
+    hardlink one stored object share the hashes of a single decode.
+    """
+
+    def __init__(self, path=HASHES_PATH):
+        self.path = path
+        self.paths = np.array([], dtype=str)
+        self.stats = np.zeros((0, 2), dtype=np.int64)  # size, mtime_ns
+        self.hashes = np.zeros((0, len(HASH_NAMES)), dtype=np.uint64)
+        if os.path.exists(path):
+            with np.load(path) as data:
+                self.paths, self.stats, self.hashes = data["paths"], data["stats"], data["hashes"]
+
+    def update(self, images_dir=IMAGES_DIR, processes=PROCESSES):
+        """Rescan images_dir and hash new or changed images on a process pool; returns how many files were decoded."""
+        known = {path: index for index, path in enumerate(self.paths.tolist())}
+        paths, stats, hashes = [], [], []
+        pending = {}
+        for path in iter_image_paths(images_dir):
+            stat = os.stat(path)
+            index = known.get(path)
+            if index is not None and tuple(self.stats[index]) == (stat.st_size, stat.st_mtime_ns):
+                paths.append(path)
+                stats.append((stat.st_size, stat.st_mtime_ns))
+                hashes.append(tuple(self.hashes[index]))
+            else:
+                pending.setdefault((stat.st_dev, stat.st_ino), []).append((path, stat))
+
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            first_paths = [links[0][0] for links in pending.values()]
+            for links, result in zip(pending.values(), executor.map(hash_file, first_paths, chunksize=CHUNK_SIZE)):
+                if result is None:
+                    continue
+                for path, stat in links:
+                    paths.append(path)
+                    stats.append((stat.st_size, stat.st_mtime_ns))
+                    hashes.append(result)
+
+        self.paths = np.array(paths, dtype=str)
+        self.stats = np.array(stats, dtype=np.int64).reshape(-1, 2)
+        self.hashes = np.array(hashes, dtype=np.uint64).reshape(-1, len(HASH_NAMES))
+        return len(pending)
+
+    def save(self):
+        temp_path = f"{self.path}.part"
+        with open(temp_path, "wb") as file:
+            np.savez(file, paths=self.paths, stats=self.stats, hashes=self.hashes)
+        os.replace(temp_path, self.path)
+
+    def column(self, name=HASH):
+        return np.ascontiguousarray(self.hashes[:, HASH_NAMES.index(name)])
+
+    def query(self, value, name=HASH, threshold=THRESHOLD):
+        """Return (indices, distances) of the images within threshold of one 64-bit hash, nearest first."""
+        distances = popcount(self.column(name) ^ np.uint64(value))
+        indices = np.flatnonzero(distances <= threshold)
+        order = np.argsort(distances[indices], kind="stable")
+        return indices[order], distances[indices][order]
+
+
+def brute_force_pairs(hashes, threshold, block_elements=BLOCK_ELEMENTS):
+    """Return every pair (i, j), i < j, within threshold, comparing a block of rows against all later ones at a time."""
+    lefts, rights = [], []
+    block_size = max(1, block_elements // max(1, len(hashes)))
+    for start in range(0, len(hashes), block_size):
+        block = hashes[start : start + block_size]
+        distances = popcount(block[:, None] ^ hashes[None, start:])
+        rows, columns = np.nonzero(distances <= threshold)
+        keep = columns > rows  # Each pair once, and no image paired with itself
+        lefts.append(rows[keep] + start)
+        rights.append(columns[keep] + start)
+    return np.concatenate(lefts or [np.array([], dtype=np.int64)]), np.concatenate(rights or [np.array([], dtype=np.int64)])
+
+
+def bucketed_pairs(hashes, threshold):
+    """Return every pair (i, j), i < j, within threshold by multi-index bucketing.
+
+    The 64 bits are split into threshold + 1 bands; two hashes that differ in
+    at most threshold bits agree exactly on at least one band. Sorting each
+    band's values makes equal ones adjacent, so candidates are found without
+    comparing all pairs, and only they get the full distance check.
+    """
+    bands = threshold + 1
+    bounds = np.linspace(0, 64, bands + 1).astype(int)
+    found = [np.array([], dtype=np.int64)]
+    for low, high in zip(bounds[:-1], bounds[1:]):
+        keys = (hashes >> np.uint64(low)) & np.uint64((1 << (high - low)) - 1)
+        order = np.argsort(keys, kind="stable")
+        keys, sorted_hashes = keys[order], hashes[order]
+        offset = 1
+        while offset < len(keys):
+            same = keys[:-offset] == keys[offset:]
+            if not same.any():
+                break  # Equal keys are contiguous, so no bucket spans a larger offset
+            same &= popcount(sorted_hashes[:-offset] ^ sorted_hashes[offset:]) <= threshold
+            left, right = order[:-offset][same], order[offset:][same]
+            # A pair may agree on several bands, so pairs are collected as codes and deduplicated at the end
+            found.append(np.minimum(left, right).astype(np.int64) * len(hashes) + np.maximum(left, right))
+            offset += 1
+    codes = np.unique(np.concatenate(found))
+    return codes // len(hashes), codes % len(hashes)
+
+
+def near_duplicate_pairs(hashes, threshold=THRESHOLD):
+    """Return (lefts, rights) index arrays of all pairs within threshold, bucketed while bands stay selective."""
+    if threshold < 8:  # Bands of 8+ bits keep buckets small; wider thresholds would compare most pairs anyway
+        return bucketed_pairs(hashes, threshold)
+    return brute_force_pairs(hashes, threshold)
+
+
+def duplicate_groups(count, lefts, rights):
+    """Return the connected components of the pair graph that have more than one member, as index arrays."""
+    labels = np.arange(count)
+    while len(lefts):
+        low = np.minimum(labels[lefts], labels[rights])
+        merged = labels.copy()
+        np.minimum.at(merged, lefts, low)
+        np.minimum.at(merged, rights, low)
+        merged = merged[merged]  # Pointer jumping halves the remaining chain lengths
+        if np.array_equal(merged, labels):
+            break
+        labels = merged
+    order = np.argsort(labels, kind="stable")
+    _, starts, sizes = np.unique(labels[order], return_index=True, return_counts=True)
+    return [order[start : start + size] for start, size in zip(starts, sizes) if size > 1]
+
+
+def find_groups(index, name=HASH, threshold=THRESHOLD, same_keyword=False):
+    """Return lists of paths whose images are near-duplicates of each other."""
+    lefts, rights = near_duplicate_pairs(index.column(name), threshold)
+    if same_keyword:
+        folders = np.array([os.path.dirname(path) for path in index.paths.tolist()])
+        keep = folders[lefts] == folders[rights]
+        lefts, rights = lefts[keep], rights[keep]
+    return [index.paths[group].tolist() for group in duplicate_groups(len(index.paths), lefts, rights)]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def prune(groups, manifest, store_dir=STORE_DIR):
+    """Delete all but the largest image of each group; returns the removed paths.
+
+    Each removal is recorded in the crawl manifest, so later downloads do not
+    link the image back into its keyword folder, and the stored object is
+    deleted once no keyword folder links it. Paths that are hardlinks of the
+    kept image cost no space and are left alone.
+    """
+    removed = []
+    for paths in groups:
+        paths = [path for path in paths if os.path.exists(path)]
+        if len(paths) < 2:
+            continue
+        keep = max(paths, key=lambda path: (os.path.getsize(path), path))
+        for path in paths:
+            if os.path.samefile(path, keep):
+                continue
+            digest = file_sha256(path)
+            manifest.exclude(os.path.basename(os.path.dirname(path)), digest)
+            os.remove(path)
+            removed.append(path)
+            object_path = os.path.join(store_dir, "objects", digest[:2], digest)
+            if os.path.exists(object_path) and os.stat(object_path).st_nlink == 1:
+                os.remove(object_path)  # Only the store itself still held it
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["report", "prune"])
+    parser.add_argument("--images-dir", default=IMAGES_DIR)
+    parser.add_argument("--hash", choices=HASH_NAMES, default=HASH)
+    parser.add_argument("--threshold", type=int, default=THRESHOLD, help="largest Hamming distance counted as a duplicate")
+    parser.add_argument(
+        "--scope",
+        choices=["keyword", "all"],
+        help="group images within each keyword folder or across all of them (default: all for report, keyword for prune)",
+    )
+    parser.add_argument("--processes", type=int, default=PROCESSES)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    index = HashIndex(os.path.join(args.images_dir, ".phash.npz"))
+    decoded = index.update(args.images_dir, args.processes)
+    index.save()
+    log.info("Hashed %d new or changed files, %d images indexed", decoded, len(index.paths))
+
+    scope = args.scope or ("all" if args.command == "report" else "keyword")
+    groups = find_groups(index, args.hash, args.threshold, same_keyword=scope == "keyword")
+    if args.command == "report":
+        for paths in groups:
+            print(f"{len(paths)} near-duplicates:")
+            for path in paths:
+                print(f"  {path}")
+        print(f"{len(groups)} groups covering {sum(len(paths) for paths in groups)} images")
+    else:
+        manifest = CrawlManifest(os.path.join(args.images_dir, ".store", "manifest.sqlite"))
+        try:
+            removed = prune(groups, manifest, os.path.join(args.images_dir, ".store"))
+        finally:
+            manifest.close()
+        print(f"Removed {len(removed)} near-duplicates from {len(groups)} groups")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import os
+import shutil
+import time
+import uuid
+
+STORE_DIR = "pexels_images/.store"  # Keep the store on the same filesystem as the keyword folders so hardlinks work
+STALE_TEMP_SECONDS = 600  # Well past download.REQUEST_TIMEOUT, so an untouched temp file belongs to a run that died
+
+
+class ImageStore:
+    """Content-addressed store of downloaded images shared by every keyword folder.
+
+    Each image is kept once under objects/<hash[:2]>/<hash>. Keyword folders
+    get hardlinks to the stored objects instead of their own copies; which URL
+    maps to which hash is tracked by the crawl manifest.
+    """
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+        self.sweep_temp()
+
+    def sweep_temp(self, max_age=STALE_TEMP_SECONDS):
+        """Remove temp files an interrupted run never recorded, leaving other processes' in-flight downloads alone."""
+        cutoff = time.time() - max_age
+        for entry in os.scandir(os.path.join(self.root, "tmp")):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass  # Finished and moved into the store meanwhile
+
+    def object_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def temp_path(self):
+        """Return a fresh path to download into before the content hash is known."""
+        return os.path.join(self.root, "tmp", uuid.uuid4().hex)
+
+    def has(self, digest):
+        return bool(digest) and os.path.exists(self.object_path(digest))
+
+    def add(self, path, digest):
+        """Move a downloaded file into the store under its content hash."""
+        object_path = self.object_path(digest)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        if os.path.exists(object_path):
+            os.remove(path)  # Same bytes already stored under another URL
+        else:
+            os.replace(path, object_path)
+        return object_path
+
+    def link(self, object_path, image_path):
+        """Point image_path at a stored object, replacing whatever stale file is there."""
+        if os.path.exists(image_path) and os.path.samefile(object_path, image_path):
+            return False
+        temp_path = f"{image_path}.part"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        try:
+            os.link(object_path, temp_path)
+        except OSError:
+            shutil.copyfile(object_path, temp_path)
+        os.replace(temp_path, image_path)
+        return True
@@ -0,0 +1,321 @@
+"""Verify downloaded images on a process pool, index their format and size, and write resized variants.
+
+    python image_verify.py                                   # verify new or changed images
+    python image_verify.py --variants 512,256 --format webp  # also keep resized copies under .variants/
+    python image_verify.py --remove-corrupt                  # delete corrupt files so the next download refetches them
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+
+from PIL import Image, ImageOps
+
+from manifest import CrawlManifest
+from metrics import Registry, Reporter
+
+IMAGES_DIR = "pexels_images"  # Keyword folders written by download.py
+INDEX_PATH = "pexels_images/.index.sqlite"  # Sidecar index of verified images
+VARIANTS_DIR = "pexels_images/.variants"  # Resized copies, as <size>/<keyword>/<name>.<format>
+STORE_DIR = "pexels_images/.store"  # Content-addressed store the keyword folders link into
+PROCESSES = os.cpu_count() or 4  # Worker processes decoding images
+BATCH_SIZE = 32  # Images per task sent to a worker
+VARIANT_SIZES = ()  # Longest side of each variant in pixels; empty writes no variants
+VARIANT_FORMAT = "webp"  # "webp" or "jpeg"
+VARIANT_QUALITY = 80
+METRICS_PATH = "verify_metrics.prom"  # Prometheus text file rewritten while verification runs
+LOG_LEVEL = logging.INFO  # DEBUG logs every corrupt image
+
+EXTENSIONS = {"webp": ".webp", "jpeg": ".jpg"}
+SAVE_MODES = {"webp": ("RGB", "RGBA"), "jpeg": ("RGB", "L")}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    format TEXT,
+    width INTEGER,
+    height INTEGER,
+    mode TEXT,
+    variants TEXT NOT NULL,
+    error TEXT,
+    checked_at REAL NOT NULL
+)
+"""
+
+log = logging.getLogger("image_verify")
+METRICS = Registry("verify_")
+IMAGES = METRICS.counter("images_total", "Image paths by outcome", ["result"])
+BYTES = METRICS.counter("bytes_total", "Image bytes decoded")
+VARIANT_BYTES = METRICS.counter("variant_bytes_total", "Bytes written to resized variants")
+DECODE_SECONDS = METRICS.histogram("decode_seconds", "Time a worker spent decoding one image and writing its variants")
+STAGE_SECONDS = METRICS.histogram("stage_seconds", "Duration of each run stage", ["stage"], buckets=(1, 10, 60, 300, 1800, 3600, 14400))
+
+
+def variant_spec(sizes, variant_format=VARIANT_FORMAT, quality=VARIANT_QUALITY):
+    """Describe the variant settings, so changing them re-processes images that were verified under others."""
+    if not sizes:
+        return ""
+    return f"{variant_format}:{quality}:{','.join(str(size) for size in sizes)}"
+
+
+def variant_path(path, size, images_dir=IMAGES_DIR, variants_dir=VARIANTS_DIR, variant_format=VARIANT_FORMAT):
+    relative = os.path.splitext(os.path.relpath(path, images_dir))[0]
+    return os.path.join(variants_dir, str(size), relative + EXTENSIONS[variant_format])
+
+
+def link_or_copy(source, path):
+    """Atomically give path the contents of source, as a hardlink where the filesystem allows."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.part"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    try:
+        os.link(source, temp_path)
+    except OSError:
+        shutil.copyfile(source, temp_path)
+    os.replace(temp_path, path)
+
+
+def save_variant(image, size, paths, variant_format, quality):
+    """Write image shrunk to fit size x size to the first path and link the others to it; returns bytes written."""
+    variant = image.copy()
+    variant.thumbnail((size, size), Image.LANCZOS)  # Never enlarges
+    if variant.mode not in SAVE_MODES[variant_format]:
+        variant = variant.convert("RGBA" if variant_format == "webp" and "A" in variant.getbands() else "RGB")
+    first = paths[0]
+    os.makedirs(os.path.dirname(first), exist_ok=True)
+    temp_path = f"{first}.part"
+    variant.save(temp_path, format=variant_format.upper(), quality=quality)
+    os.replace(temp_path, first)
+    for path in paths[1:]:
+        link_or_copy(first, path)
+    return os.path.getsize(first)
+
+
+def verify_image(path, variants=(), variant_format=VARIANT_FORMAT, quality=VARIANT_QUALITY):
+    """Decode one image completely and write its variants, given as (size, [variant paths]) pairs.
+
+    Returns a result dict: format, width, height and mode for a good image,
+    or the error and the file's sha256 for a corrupt one.
+    """
+    start = time.perf_counter()
+    result = {"elapsed": 0.0, "variant_bytes": 0}
+    try:
+        with Image.open(path) as image:
+            image.verify()  # Header and structure checks, without decoding pixels
+        with Image.open(path) as image:
+            image.load()  # Full decode: truncated or damaged bodies raise here
+            result.update(format=image.format, width=image.width, height=image.height, mode=image.mode)
+            if variants:
+                oriented = ImageOps.exif_transpose(image)
+                for size, paths in variants:
+                    result["variant_bytes"] += save_variant(oriented, size, paths, variant_format, quality)
+    except Exception as e:  # Pillow signals bad data with OSError, SyntaxError, ValueError and others
+        result["error"] = f"{type(e).__name__}: {e}"
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        result["sha256"] = digest.hexdigest()
+    result["elapsed"] = time.perf_counter() - start
+    return result
+
+
+def verify_batch(batch, variant_format=VARIANT_FORMAT, quality=VARIANT_QUALITY):
+    return [verify_image(path, variants, variant_format, quality) for path, variants in batch]
+
+
+def iter_image_paths(images_dir=IMAGES_DIR):
+    """Yield the image paths in every keyword folder, skipping the store, index and variants."""
+    for keyword in sorted(os.listdir(images_dir)):
+        folder = os.path.join(images_dir, keyword)
+        if keyword.startswith(".") or not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if not name.endswith(".part"):
+                yield os.path.join(folder, name)
+
+
+class VerifyIndex:
+    """Sidecar index of verified images, keyed by path and checked against each file's size and mtime."""
+
+    def __init__(self, path=INDEX_PATH):
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(SCHEMA)
+        self._connection.commit()
+
+    def entries(self):
+        """Return {path: (size, mtime_ns, variants, status)} for every indexed image."""
+        return {row[0]: row[1:] for row in self._connection.execute("SELECT path, size, mtime_ns, variants, status FROM images")}
+
+    def record(self, rows):
+        """Upsert (path, size, mtime_ns, status, format, width, height, mode, variants, error) rows."""
+        now = time.time()
+        with self._connection:
+            self._connection.executemany(
+                """
+                INSERT INTO images (path, size, mtime_ns, status, format, width, height, mode, variants, error, checked_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (path) DO UPDATE SET
+                    size = excluded.size, mtime_ns = excluded.mtime_ns, status = excluded.status,
+                    format = excluded.format, width = excluded.width, height = excluded.height,
+                    mode = excluded.mode, variants = excluded.variants, error = excluded.error,
+                    checked_at = excluded.checked_at
+                """,
+                (row + (now,) for row in rows),
+            )
+
+    def forget(self, paths):
+        with self._connection:
+            self._connection.executemany("DELETE FROM images WHERE path = ?", ((path,) for path in paths))
+
+    def counts(self):
+        return dict(self._connection.execute("SELECT status, COUNT(*) FROM images GROUP BY status").fetchall())
+
+    def close(self):
+        self._connection.close()
+
+
+def pending_files(index, images_dir=IMAGES_DIR, spec="", recheck_corrupt=False):
+    """Group new or changed image paths by the file they point at, and return ({(dev, inode): [paths]}, unchanged, gone).
+
+    Keyword folders hardlink one stored object wherever a photo repeats,
+    so each distinct file is decoded once however many paths it has.
+    recheck_corrupt also returns unchanged files that were found corrupt before.
+    """
+    entries = index.entries()
+    files = {}
+    unchanged = 0
+    for path in iter_image_paths(images_dir):
+        stat = os.stat(path)
+        entry = entries.pop(path, None)
+        if entry and entry[:3] == (stat.st_size, stat.st_mtime_ns, spec) and not (recheck_corrupt and entry[3] == "corrupt"):
+            unchanged += 1
+            continue
+        files.setdefault((stat.st_dev, stat.st_ino), []).append((path, stat))
+    return files, unchanged, list(entries)  # Whatever is left in entries no longer exists
+
+
+def remove_corrupt(paths, sha256, manifest, store_dir=STORE_DIR):
+    """Delete a corrupt file's paths and its stored object, and drop its manifest records so it is downloaded again."""
+    object_path = os.path.join(store_dir, "objects", sha256[:2], sha256)
+    for path in paths + [object_path]:
+        if os.path.exists(path):
+            os.remove(path)
+    return manifest.forget(sha256)
+
+
+def verify_all(
+    images_dir=IMAGES_DIR,
+    index_path=INDEX_PATH,
+    variants_dir=VARIANTS_DIR,
+    sizes=VARIANT_SIZES,
+    variant_format=VARIANT_FORMAT,
+    quality=VARIANT_QUALITY,
+    processes=PROCESSES,
+    batch_size=BATCH_SIZE,
+    remove=False,
+    store_dir=STORE_DIR,
+):
+    """Verify new or changed images in images_dir on a process pool and record them in the index."""
+    index = VerifyIndex(index_path)
+    manifest = CrawlManifest(os.path.join(store_dir, "manifest.sqlite")) if remove else None
+    spec = variant_spec(sizes, variant_format, quality)
+    stats = {"ok": 0, "corrupt": 0, "removed": 0, "unchanged": 0}
+
+    files, stats["unchanged"], gone = pending_files(index, images_dir, spec, recheck_corrupt=remove)
+    index.forget(gone)
+    IMAGES.inc(stats["unchanged"], result="unchanged")
+
+    def task(links):
+        variants = [(size, [variant_path(path, size, images_dir, variants_dir, variant_format) for path, _ in links]) for size in sizes]
+        return links[0][0], variants
+
+    def finish(links, result):
+        paths = [path for path, _ in links]
+        BYTES.inc(links[0][1].st_size)
+        DECODE_SECONDS.observe(result["elapsed"])
+        if "error" not in result:
+            VARIANT_BYTES.inc(result["variant_bytes"])
+            status = "ok"
+        elif remove:
+            remove_corrupt(paths, result["sha256"], manifest, store_dir)
+            index.forget(paths)
+            log.debug("Removed corrupt %s (%s)", paths[0], result["error"])
+            stats["removed"] += len(paths)
+            IMAGES.inc(len(paths), result="removed")
+            return
+        else:
+            log.debug("Corrupt %s: %s", paths[0], result["error"])
+            status = "corrupt"
+        stats[status] += len(paths)
+        IMAGES.inc(len(paths), result=status)
+        index.record(
+            (path, stat.st_size, stat.st_mtime_ns, status, result.get("format"), result.get("width"), result.get("height"),
+             result.get("mode"), spec, result.get("error"))
+            for path, stat in links
+        )
+
+    groups = iter(files.values())
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        tasks = {}
+        while True:
+            batch = list(islice(groups, batch_size))
+            if batch:
+                tasks[executor.submit(verify_batch, [task(links) for links in batch], variant_format, quality)] = batch
+            # Keep a couple of batches per worker queued, record whatever is finished
+            if tasks and (not batch or len(tasks) >= processes * 2):
+                done, _ = wait(tasks, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for links, result in zip(tasks.pop(future), future.result()):
+                        finish(links, result)
+            if not batch and not tasks:
+                break
+
+    index.close()
+    if manifest is not None:
+        manifest.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images-dir", default=IMAGES_DIR)
+    parser.add_argument("--variants", default=",".join(map(str, VARIANT_SIZES)), help="comma-separated longest sides, e.g. 512,256")
+    parser.add_argument("--format", choices=sorted(EXTENSIONS), default=VARIANT_FORMAT, help="variant format")
+    parser.add_argument("--quality", type=int, default=VARIANT_QUALITY)
+    parser.add_argument("--processes", type=int, default=PROCESSES)
+    parser.add_argument("--remove-corrupt", action="store_true", help="delete corrupt images and forget them in the crawl manifest")
+    parser.add_argument("--metrics-path", default=METRICS_PATH)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    sizes = tuple(int(size) for size in args.variants.split(",") if size)
+    images_dir = args.images_dir
+    with Reporter(METRICS, args.metrics_path, logger=log), STAGE_SECONDS.time(stage="verify"):
+        stats = verify_all(
+            images_dir,
+            os.path.join(images_dir, ".index.sqlite"),
+            os.path.join(images_dir, ".variants"),
+            sizes,
+            args.format,
+            args.quality,
+            args.processes,
+            remove=args.remove_corrupt,
+            store_dir=os.path.join(images_dir, ".store"),
+        )
+    print(f"Verified {stats['ok']} images, {stats['corrupt']} corrupt, removed {stats['removed']}, unchanged {stats['unchanged']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import base64
+import json
+import logging
+from functools import lru_cache
+from urllib.parse import unquote
+
+try:
+    import orjson  # Optional: faster JSON parsing of token payloads
+except ImportError:
+    orjson = None
+
+JWT_CACHE_SIZE = 65536  # Distinct tokens (ad creatives) kept decoded
+TOKEN_PARAM = "ext_link_data="
+
+log = logging.getLogger("jwt_decoder")
+
+
+def extract_ext_link_data(link):
+    """Return the ext_link_data query value of a banner link without parsing the whole query string."""
+    query_start = link.find("?")
+    if query_start == -1:
+        return None
+    start = link.find(TOKEN_PARAM, query_start)
+    # Only accept the name at the start of a query parameter, not as the tail of another one
+    while start != -1 and link[start - 1] not in "?&":
+        start = link.find(TOKEN_PARAM, start + 1)
+    if start == -1:
+        return None
+    start += len(TOKEN_PARAM)
+    end = len(link)
+    for separator in "&#":
+        index = link.find(separator, start, end)
+        if index != -1:
+            end = index
+    token = link[start:end]
+    return unquote(token) if "%" in token else token
+
+
+def _loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+@lru_cache(maxsize=JWT_CACHE_SIZE)
+def decode_jwt_payload(jwt_token):
+    """Decode the payload of a JWT token without verification; repeated tokens are served from an LRU cache.
+
+    The returned dict is shared between callers of the same token and must not be modified.
+    """
+    try:
+        # JWT token consists of three parts: header, payload, and signature
+        header, payload, signature = jwt_token.split(".")
+        # Restore exactly the padding that base64url encoding strips
+        return _loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except Exception as e:
+        log.debug("Error decoding JWT token: %s", e)  # Counted by the caller as an undecodable link
+        return None
@@ -0,0 +1,118 @@
+import sqlite3
+import threading
+import time
+
+MANIFEST_PATH = "pexels_images/.store/manifest.sqlite"
+QUERY_CHUNK = 500  # URLs per IN (...) lookup, below SQLite's host parameter limit
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    url TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    size INTEGER,
+    sha256 TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    first_seen REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+# (keyword folder, sha256) pairs that later downloads must not link back, e.g. near-duplicates pruned by image_dedup.py
+EXCLUDED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS excluded (
+    folder TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (folder, sha256)
+) WITHOUT ROWID
+"""
+
+COLUMNS = ["url", "status", "size", "sha256", "etag", "last_modified", "attempts", "first_seen", "updated_at"]
+
+
+class CrawlManifest:
+    """Persistent per-URL download state, so re-runs only touch new or failed URLs.
+
+    status is "done" once the image is in the store and "failed" after an
+    unsuccessful attempt; attempts counts the failed requests since the last
+    success. A failed revalidation of a stored image keeps it "done", since
+    the stored copy is still good.
+    Images deliberately removed from a keyword folder are listed separately
+    by content hash, so that folder never gets them back.
+    """
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(SCHEMA)
+        self._connection.execute(EXCLUDED_SCHEMA)
+        self._connection.commit()
+
+    def rows(self, urls):
+        """Return {url: row dict} for the urls that have a record."""
+        urls = list(dict.fromkeys(urls))
+        found = {}
+        with self._lock:
+            for start in range(0, len(urls), QUERY_CHUNK):
+                chunk = urls[start : start + QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                cursor = self._connection.execute(f"SELECT {', '.join(COLUMNS)} FROM images WHERE url IN ({placeholders})", chunk)
+                for values in cursor:
+                    found[values[0]] = dict(zip(COLUMNS, values))
+        return found
+
+    def _upsert(self, url, status, size=None, sha256=None, etag=None, last_modified=None):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                """
+                INSERT INTO images (url, status, size, sha256, etag, last_modified, attempts, first_seen, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    status = CASE WHEN excluded.status = 'failed' AND status = 'done' THEN status ELSE excluded.status END,
+                    size = COALESCE(excluded.size, size),
+                    sha256 = COALESCE(excluded.sha256, sha256),
+                    etag = COALESCE(excluded.etag, etag),
+                    last_modified = COALESCE(excluded.last_modified, last_modified),
+                    attempts = CASE WHEN excluded.status = 'failed' THEN attempts + 1 ELSE 0 END,
+                    updated_at = excluded.updated_at
+                """,
+                (url, status, size, sha256, etag, last_modified, int(status == "failed"), now, now),
+            )
+            self._connection.commit()
+
+    def record_success(self, url, size, sha256, etag=None, last_modified=None):
+        self._upsert(url, "done", size, sha256, etag, last_modified)
+
+    def record_not_modified(self, url):
+        """Mark a conditional GET answered with 304; the stored copy is still current."""
+        self._upsert(url, "done")
+
+    def record_failure(self, url):
+        self._upsert(url, "failed")
+
+    def forget(self, sha256):
+        """Drop every URL whose download produced sha256, so the next run fetches them again; returns how many."""
+        with self._lock:
+            cursor = self._connection.execute("DELETE FROM images WHERE sha256 = ?", (sha256,))
+            self._connection.commit()
+            return cursor.rowcount
+
+    def exclude(self, folder, sha256):
+        """Keep the image with sha256 out of the keyword folder named folder on every later run."""
+        with self._lock:
+            self._connection.execute("INSERT OR IGNORE INTO excluded (folder, sha256) VALUES (?, ?)", (folder, sha256))
+            self._connection.commit()
+
+    def excluded(self):
+        """Return the set of (folder, sha256) pairs kept out of keyword folders."""
+        with self._lock:
+            return set(self._connection.execute("SELECT folder, sha256 FROM excluded"))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
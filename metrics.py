@@ -0,0 +1,252 @@
+"""Lightweight counters, gauges and histograms shared by the crawl scripts.
+
+Hot loops record into in-process metrics instead of printing a line per
+request, URL or image. A Reporter logs a one-line summary every few seconds
+and rewrites a Prometheus text file (node_exporter textfile format) that a
+scraper or a person can read while the job runs.
+"""
+
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+METRICS_INTERVAL = 10  # Seconds between summary lines and text file rewrites
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # Upper bounds in seconds
+
+log = logging.getLogger("metrics")
+
+
+def _label_text(labelnames, key):
+    if not labelnames:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(labelnames, key))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help="", labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def total(self):
+        with self._lock:
+            return sum(self._values.values())
+
+    def samples(self):
+        """Yield (name suffix, label text, value) lines for the text exposition format."""
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield "", _label_text(self.labelnames, key), value
+
+
+class Counter(Metric):
+    """A monotonically increasing count, optionally split by labels."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down, such as the number of requests in flight."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Observations counted into fixed buckets, with their sum, for latencies and sizes."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help="", labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in the with block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def total(self):
+        with self._lock:
+            return sum(entry[2] for entry in self._values.values())
+
+    def quantile(self, q):
+        """Estimate a quantile over all label sets as the upper bound of the bucket that reaches it."""
+        with self._lock:
+            counts = [sum(column) for column in zip(*(entry[0] for entry in self._values.values()))]
+        observed = sum(counts)
+        if not observed:
+            return None
+        running = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            running += count
+            if running >= q * observed:
+                return bound
+        return float("inf")
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in self._values.items())
+        for key, (counts, total, observed) in values:
+            running = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                running += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield "_bucket", _label_text(self.labelnames + ("le",), key + (le,)), running
+            yield "_sum", _label_text(self.labelnames, key), total
+            yield "_count", _label_text(self.labelnames, key), observed
+
+
+class Registry:
+    """A named set of metrics that renders to the Prometheus text format and a short summary line."""
+
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labelnames, **kwargs):
+        name = self.prefix + name
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, help="", labelnames=()):
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name, help="", labelnames=()):
+        return self._get(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help="", labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            if metric.help:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Atomically replace path with the current metrics, so readers never see a half-written file."""
+        temp_path = f"{path}.part"
+        with open(temp_path, "w") as file:
+            file.write(self.render())
+        os.replace(temp_path, path)
+
+    def summary(self, previous=None, elapsed=None):
+        """Return a one-line summary; with the totals of the previous call, counters also show their rate."""
+        parts = []
+        totals = {}
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            name = metric.name[len(self.prefix) :]
+            total = totals[metric.name] = metric.total()
+            if isinstance(metric, Histogram):
+                if total:
+                    parts.append(f"{name} p50<={metric.quantile(0.5)} p99<={metric.quantile(0.99)} n={total}")
+            elif isinstance(metric, Counter) and previous is not None and elapsed:
+                parts.append(f"{name}={total:g} ({(total - previous.get(metric.name, 0)) / elapsed:.1f}/s)")
+            else:
+                parts.append(f"{name}={total:g}")
+        return ", ".join(parts), totals
+
+
+class Reporter:
+    """Log a summary of a registry every interval seconds and keep its text file current.
+
+    Used as a context manager around a run; a final summary and file are written on exit.
+    """
+
+    def __init__(self, registry, path=None, interval=METRICS_INTERVAL, logger=log):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.logger = logger
+        self._stop = threading.Event()
+        self._thread = None
+        self._previous = {}
+        self._last = time.perf_counter()
+
+    def report(self):
+        now = time.perf_counter()
+        line, self._previous = self.registry.summary(self._previous, now - self._last)
+        self._last = now
+        if line:
+            self.logger.info(line)
+        if self.path:
+            self.registry.write(self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.report()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,85 @@
+import json
+import logging
+import re
+import requests
+from urllib.parse import quote
+
+SEARCH_BASE = "https://www.pexels.com"  # Point at a local server to crawl saved pages
+MAX_PAGES = 10  # Result pages to read per keyword before giving up
+REQUEST_TIMEOUT = 30  # Seconds to wait for a search page
+
+headers = {
+    "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "accept-language": "en-US,en;q=0.9",
+    "user-agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36",
+}
+
+NEXT_DATA_PATTERN = re.compile(r'<script id="__NEXT_DATA__" type="application/json">(.*?)</script>', re.S)
+IMAGE_URL_PATTERN = re.compile(r"https://images\.pexels\.com/photos/\d+/[^\"'\s<>\\?]+(?:\?[^\"'\s<>\\]*)?")
+IMAGE_SIZE_KEYS = ["medium", "large", "small", "download_link"]  # Preferred order; download.py drops the query anyway
+
+log = logging.getLogger("pexels_http")
+
+
+def create_session():
+    """Create a keep-alive session for fetching search pages."""
+    session = requests.Session()
+    session.headers.update(headers)
+    return session
+
+
+def search_page_url(keyword, page, base=SEARCH_BASE):
+    return f"{base}/search/{quote(keyword)}/?page={page}"
+
+
+def _walk_photos(node, found):
+    """Collect image URLs from every photo-like object in the embedded page data."""
+    if isinstance(node, dict):
+        image = node.get("image")
+        if isinstance(image, dict):
+            for key in IMAGE_SIZE_KEYS:
+                if isinstance(image.get(key), str):
+                    found.append(image[key])
+                    break
+        for value in node.values():
+            _walk_photos(value, found)
+    elif isinstance(node, list):
+        for value in node:
+            _walk_photos(value, found)
+
+
+def parse_image_urls(html):
+    """Return the photo URLs on a search result page, in page order.
+
+    The page embeds its results as JSON in the __NEXT_DATA__ script; if that
+    is missing or changes shape, fall back to scanning the markup for image URLs.
+    """
+    found = []
+    match = NEXT_DATA_PATTERN.search(html)
+    if match:
+        try:
+            _walk_photos(json.loads(match.group(1)), found)
+        except ValueError:
+            found = []
+    if not found:
+        found = [url.replace("&amp;", "&") for url in IMAGE_URL_PATTERN.findall(html)]
+    # The markup repeats each photo at several sizes (src and srcset), so keep the first URL per photo
+    by_photo = {}
+    for url in found:
+        by_photo.setdefault(url.split("?")[0], url)
+    return list(by_photo.values())
+
+
+def collect_image_urls(session, keyword, limit=100, base=SEARCH_BASE):
+    """Read search result pages for keyword until limit URLs are found or results run out."""
+    urls = {}
+    for page in range(1, MAX_PAGES + 1):
+        response = session.get(search_page_url(keyword, page, base), timeout=REQUEST_TIMEOUT)
+        if response.status_code != 200:
+            log.warning("Failed to fetch page %d for %s: Status code %d", page, keyword, response.status_code)
+            break
+        before = len(urls)
+        urls.update(dict.fromkeys(parse_image_urls(response.text)))
+        if len(urls) >= limit or len(urls) == before:  # Enough results, or the page added nothing new
+            break
+    return list(urls)[:limit]
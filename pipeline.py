@@ -0,0 +1,266 @@
+"""Collect Pexels image URLs and download them as one pipelined job.
+
+Each keyword's URLs go onto a bounded queue as soon as they are collected and
+are downloaded while the next keywords are still being crawled, so a run
+takes about as long as the slower stage instead of both added up.
+
+    python pipeline.py             # skip keywords an earlier run completed without failures
+    python pipeline.py --restart   # collect and download every keyword again
+"""
+
+import argparse
+import json
+import logging
+import os
+import queue
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime
+from functools import partial
+
+import download
+import Pexels
+from image_store import ImageStore
+from manifest import CrawlManifest
+from metrics import Registry, Reporter
+
+IMAGES_DIR = "pexels_images"  # Directory to save images into
+QUEUE_SIZE = 4  # Collected keywords waiting for the download stage before collection pauses
+MAX_QUEUED = 256  # Image downloads submitted to the pool but not finished
+PROGRESS_PATH = "pipeline_progress.jsonl"  # One line per keyword whose images have all been handled
+METRICS_PATH = "pipeline_metrics.prom"  # Prometheus text file rewritten while the pipeline runs
+LOG_LEVEL = logging.INFO
+
+log = logging.getLogger("pipeline")
+METRICS = Registry("pipeline_")
+KEYWORDS = METRICS.counter("keywords_total", "Keywords through each stage", ["stage"])
+QUEUE_DEPTH = METRICS.gauge("queue_depth", "Collected keywords waiting for the download stage")
+STAGE_SECONDS = METRICS.histogram("stage_seconds", "Duration of each run stage", ["stage"], buckets=(1, 10, 60, 300, 1800, 3600, 14400))
+
+_END = object()  # Put on the queue once collection has finished or stopped
+
+
+class CollectionStopped(Exception):
+    """Raised from the collection callback to end a crawl early on shutdown."""
+
+
+class KeywordProgress:
+    """Count each keyword's image paths down to zero and record the keywords that finish.
+
+    Keywords recorded without failures are skipped by the next run unless it restarts.
+    """
+
+    def __init__(self, path=PROGRESS_PATH, resume=True):
+        self.path = path
+        self.completed = set()
+        if resume and os.path.exists(path):
+            with open(path, "r") as file:
+                for line in file:
+                    entry = json.loads(line)
+                    if not entry["failed"]:
+                        self.completed.add(entry["keyword"])
+        self._remaining = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def start(self, keyword, paths):
+        with self._lock:
+            self._remaining[keyword] = paths
+            self._stats[keyword] = download.new_stats()
+        if not paths:
+            self._complete(keyword)
+
+    def finish(self, keyword, paths, stats):
+        """Count paths of keyword as handled, with their download stats."""
+        with self._lock:
+            for key, value in stats.items():
+                self._stats[keyword][key] += value
+            self._remaining[keyword] -= paths
+            done = self._remaining[keyword] == 0
+        if done:
+            self._complete(keyword)
+
+    def pending(self):
+        with self._lock:
+            return [keyword for keyword, remaining in self._remaining.items() if remaining]
+
+    def _complete(self, keyword):
+        with self._lock:
+            del self._remaining[keyword]
+            stats = self._stats.pop(keyword)
+            entry = {"keyword": keyword, **stats, "finished_at": datetime.now().isoformat(timespec="seconds")}
+            with open(self.path, "a") as file:
+                file.write(json.dumps(entry) + "\n")
+        KEYWORDS.inc(stage="completed")
+        log.info(
+            "%s complete: %d downloaded, %d not modified, %d linked, %d already in place, %d failed",
+            keyword, stats["downloaded"], stats["not_modified"], stats["linked"], stats["skipped"], stats["failed"],
+        )
+
+
+class DownloadStage:
+    """Download keyword batches on one shared thread pool as they arrive.
+
+    At most max_queued downloads are submitted at a time, so a slow download
+    stage backs up into the keyword queue and pauses collection instead of
+    buffering every URL. A URL already being fetched for another keyword is
+    not fetched twice: its paths wait and are linked once it is stored.
+    """
+
+    def __init__(self, progress, images_dir=IMAGES_DIR, max_workers=download.MAX_WORKERS, max_queued=MAX_QUEUED):
+        self.progress = progress
+        self.images_dir = images_dir
+        self.store = ImageStore(f"{images_dir}/.store")
+        self.manifest = CrawlManifest(os.path.join(self.store.root, "manifest.sqlite"))
+        self.session = download.create_session()
+        self.limiter = download.create_limiter()
+        self.stats = download.new_stats()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_queued)
+        self._in_flight = {}  # url -> [(keyword, image_paths)] waiting for the same download
+        self._outstanding = 0
+        self._condition = threading.Condition()
+
+    def add(self, keyword, urls):
+        jobs = download.build_jobs(urls, f"{self.images_dir}/{keyword.replace(' ', '_')}")
+        self.progress.start(keyword, len(jobs))
+        self._plan(keyword, jobs)
+
+    def _plan(self, keyword, jobs, bounded=True):
+        stats = download.new_stats()
+        pending, stored = download.plan_downloads(jobs, self.store, self.manifest, stats)
+        handled = stats["linked"] + stats["skipped"] + stats["failed"]
+        if handled:
+            self._count(keyword, handled, stats)
+        for url, image_paths in pending.items():
+            with self._condition:
+                waiting = self._in_flight.get(url)
+                if waiting is not None:
+                    waiting.append((keyword, image_paths))
+                    continue
+                self._in_flight[url] = []
+                self._outstanding += 1
+            if bounded:
+                self._slots.acquire()  # Blocks the consumer, and through the queue the collection, while downloads are behind
+            download.QUEUED.inc()
+            future = self._executor.submit(
+                download.download_image, self.session, self.limiter, self.store, self.manifest, url, image_paths, stored.get(url)
+            )
+            future.add_done_callback(partial(self._done, keyword, url, image_paths, bounded))
+
+    def _done(self, keyword, url, image_paths, bounded, future):
+        try:
+            download.QUEUED.dec()
+            stats = download.new_stats()
+            download.record_download(future, self.manifest, url, image_paths, stats)
+            if bounded:
+                self._slots.release()
+            self._count(keyword, len(image_paths), stats)
+            with self._condition:
+                waiting = self._in_flight.pop(url)
+            # Paths that arrived meanwhile are linked to the stored image now, or fetched again if the download failed
+            for other, paths in waiting:
+                self._plan(other, [(url, path) for path in paths], bounded=False)
+        finally:
+            with self._condition:
+                self._outstanding -= 1
+                self._condition.notify_all()
+
+    def _count(self, keyword, paths, stats):
+        with self._condition:
+            for key, value in stats.items():
+                self.stats[key] += value
+        self.progress.finish(keyword, paths, stats)
+
+    def drain(self):
+        """Wait for every submitted download, then release the pool and the manifest."""
+        with self._condition:
+            while self._outstanding:
+                self._condition.wait()
+        self._executor.shutdown()
+        self.manifest.close()
+
+
+def run_pipeline(keywords, crawl=Pexels.crawl, progress=None, images_dir=IMAGES_DIR, queue_size=QUEUE_SIZE, stop=None):
+    """Collect keywords with crawl(keywords, on_keyword=...) in a thread while downloading their images; returns the download stats.
+
+    Setting stop ends collection after the keyword in progress; everything
+    already collected is still downloaded before this returns.
+    """
+    progress = progress or KeywordProgress()
+    stop = stop or threading.Event()
+    stage = DownloadStage(progress, images_dir)
+    batches = queue.Queue(maxsize=queue_size)
+
+    def on_keyword(keyword, urls):
+        batches.put((keyword, urls))  # Waits while the download stage is behind
+        QUEUE_DEPTH.set(batches.qsize())
+        KEYWORDS.inc(stage="collected")
+        if stop.is_set():
+            raise CollectionStopped()
+
+    def collect():
+        try:
+            with STAGE_SECONDS.time(stage="collect"):
+                crawl(keywords, on_keyword=on_keyword)
+        except CollectionStopped:
+            log.info("Collection stopped, downloading the %d keywords already queued", batches.qsize())
+        except Exception:
+            log.exception("Collection failed, downloading the %d keywords already queued", batches.qsize())
+        finally:
+            batches.put(_END)
+
+    collector = threading.Thread(target=collect, name="collect", daemon=True)
+    collector.start()
+    with STAGE_SECONDS.time(stage="download"):
+        while True:
+            item = batches.get()
+            QUEUE_DEPTH.set(batches.qsize())
+            if item is _END:
+                break
+            stage.add(*item)
+        stage.drain()
+    collector.join()
+    unfinished = progress.pending()
+    if unfinished:
+        log.warning("Keywords left incomplete: %s", ", ".join(unfinished))
+    return stage.stats
+
+
+def main(metrics_path=METRICS_PATH):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--restart", action="store_true", help="ignore keywords completed by earlier runs")
+    parser.add_argument("--mode", choices=["http", "browser"], default=Pexels.COLLECTION_MODE, help="how URLs are collected")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    progress = KeywordProgress(resume=not args.restart)
+    keywords = [keyword for keyword in Pexels.keywords if keyword not in progress.completed]
+    log.info("%d keywords to run, %d completed earlier", len(keywords), len(Pexels.keywords) - len(keywords))
+
+    # The first Ctrl-C or SIGTERM stops collection and lets the queued keywords finish downloading; a second one exits
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        stop.set()
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, request_stop)
+
+    with ExitStack() as stack:
+        stack.enter_context(Reporter(METRICS, metrics_path, logger=log))
+        stack.enter_context(Reporter(Pexels.METRICS, Pexels.METRICS_PATH, logger=Pexels.log))
+        stack.enter_context(Reporter(download.METRICS, download.METRICS_PATH, logger=download.log))
+        stats = run_pipeline(keywords, partial(Pexels.crawl, mode=args.mode), progress, stop=stop)
+    print(
+        f"Downloaded {stats['downloaded']} images ({stats['bytes']} bytes), {stats['not_modified']} not modified, "
+        f"linked {stats['linked']}, already in place {stats['skipped']}, failed {stats['failed']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+INITIAL_CONCURRENCY = 4  # Requests per host allowed in flight before any feedback has arrived
+MIN_CONCURRENCY = 1
+ERROR_TOLERANCE = 0.1  # Smoothed share of failed responses that triggers a decrease
+ERROR_SMOOTHING = 0.02  # Weight of each new response in the smoothed error share; sporadic failures stay below tolerance
+LATENCY_TOLERANCE = 2.0  # Smoothed latency this many times its recent minimum counts as congestion
+LATENCY_SMOOTHING = 0.1  # Weight of each new response in the smoothed latency
+LATENCY_WARMUP = 10  # Latency samples smoothed before the baseline is taken
+LATENCY_FLOOR = 0.005  # Seconds; below this, latency changes are noise rather than congestion
+MIN_LATENCY_WINDOW = 30  # Seconds over which the baseline (minimum) latency is tracked
+DECREASE_FACTOR = 0.5  # Multiplicative decrease of the concurrency limit on errors and throttling
+RATE_DECREASE_FACTOR = 0.7  # Multiplicative decrease of the request rate when the host throttles
+DECREASE_INTERVAL = 1.0  # Seconds between error-driven decreases, so responses already in flight cannot compound one
+LATENCY_DECREASE_FACTOR = 0.9  # Gentler decrease when only latency has grown
+RATE_GROWTH = 0.1  # Requests/s added to a throttled host's rate per healthy response, about 10% a second
+MIN_RATE = 0.5  # Requests/s a throttled host is never slowed below
+FAILURE_STATUSES = {429, 500, 502, 503, 504}
+THROTTLE_STATUSES = {429, 503}  # Statuses that ask for a lower request rate, not just fewer connections
+
+
+def parse_retry_after(value):
+    """Return the seconds a Retry-After header asks us to wait, from either delta-seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HostLimit:
+    """Concurrency limit and token bucket for one host, adjusted by AIMD from response feedback.
+
+    The concurrency limit starts in slow start (+1 per success, doubling every
+    round trip) until the first sign of congestion, then grows by about one
+    per round trip. A sustained error share halves it, and latency well above
+    its recent minimum shrinks it gently. The token bucket only engages once
+    the host throttles (429/503): its rate is cut below the successful
+    throughput achieved, regrows about 10% a second with healthy responses,
+    and is lifted again once concurrency is the tighter limit. Retry-After
+    pauses the host outright.
+    """
+
+    def __init__(self, max_concurrency, max_rate=None, initial_concurrency=INITIAL_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.max_rate = max_rate or float("inf")
+        self.limit = float(min(initial_concurrency, max_concurrency))
+        self.rate = self.max_rate
+        self.tokens = 1.0
+        self.in_flight = 0
+        self.slow_start = True
+        self.blocked_until = 0.0
+        self.error_share = 0.0
+        self.latency = None
+        self.min_latency = None
+        self.throughput = None
+        self._latency_samples = 0
+        self._window_min = None
+        self._window_start = time.monotonic()
+        self._completed = 0
+        self._throughput_start = time.monotonic()
+        self._last_decrease = 0.0
+        self._last_refill = time.monotonic()
+        self._condition = threading.Condition()
+
+    def _refill(self, now):
+        if self.rate != float("inf"):
+            self.tokens = min(max(1.0, self.rate), self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self):
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                delay = self.blocked_until - now
+                if delay <= 0:
+                    self._refill(now)
+                    if self.in_flight >= int(self.limit):
+                        delay = None  # Woken by a release or a limit increase
+                    elif self.tokens >= 1 or self.rate == float("inf"):
+                        break
+                    else:
+                        delay = (1 - self.tokens) / self.rate
+                self._condition.wait(delay)
+            if self.rate != float("inf"):
+                self.tokens -= 1
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def _decrease(self, now, factor, throttled=False):
+        self._last_decrease = now
+        self.slow_start = False
+        self.limit = max(MIN_CONCURRENCY, self.limit * factor)
+        if throttled:
+            # Cut from the rate actually achieved; until one is measured, Little's law gives limit / latency
+            achieved = self.throughput or (self.limit / factor / self.latency if self.latency else MIN_RATE)
+            self.rate = max(MIN_RATE, min(self.rate, achieved) * RATE_DECREASE_FACTOR)
+            self.tokens = min(self.tokens, 1.0)
+
+    def _increase(self):
+        self.limit = min(self.max_concurrency, self.limit + (1 if self.slow_start else 1 / self.limit))
+        if self.rate != float("inf"):
+            self.rate += RATE_GROWTH
+            if self.rate >= self.max_rate or (self.latency and self.rate > self.limit / self.latency):
+                self.rate = self.max_rate  # Concurrency alone now keeps the rate below this
+
+    def observe(self, status, elapsed, retry_after=None):
+        """Feed back one response: status None means a connection error or timeout, elapsed None no latency sample."""
+        with self._condition:
+            now = time.monotonic()
+            failed = status is None or status in FAILURE_STATUSES
+            self._completed += not failed
+            if now - self._throughput_start >= 1:
+                self.throughput = self._completed / (now - self._throughput_start)
+                self._completed, self._throughput_start = 0, now
+
+            throttled = status in THROTTLE_STATUSES or (failed and retry_after is not None)
+            self.error_share += ERROR_SMOOTHING * (failed - self.error_share)
+            if throttled and retry_after is not None:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+
+            congested = False
+            if not failed and elapsed is not None:
+                self.latency = elapsed if self.latency is None else self.latency + LATENCY_SMOOTHING * (elapsed - self.latency)
+                self._latency_samples += 1
+                if self._latency_samples >= LATENCY_WARMUP:
+                    # The baseline is the lowest smoothed latency, so single fast outliers do not set it
+                    self._window_min = self.latency if self._window_min is None else min(self._window_min, self.latency)
+                    if self.min_latency is None or self.latency < self.min_latency:
+                        self.min_latency = self.latency
+                    if now - self._window_start > MIN_LATENCY_WINDOW:
+                        # Let the baseline follow a server that got permanently slower
+                        self.min_latency, self._window_min, self._window_start = self._window_min, None, now
+                    congested = self.latency > max(LATENCY_FLOOR, LATENCY_TOLERANCE * self.min_latency)
+
+            since_decrease = now - self._last_decrease
+            if (throttled and retry_after is not None) or self.error_share > ERROR_TOLERANCE:
+                # A burst of errors is one congestion event: react once, then measure the error share afresh
+                if since_decrease >= max(DECREASE_INTERVAL, self.latency or 0):
+                    self._decrease(now, DECREASE_FACTOR, throttled)
+                    self.error_share = 0.0
+            elif congested:
+                if since_decrease >= self.latency:  # At most once per round trip
+                    self._decrease(now, LATENCY_DECREASE_FACTOR)
+            elif not failed:
+                self._increase()
+            self._condition.notify_all()
+
+
+class AdaptiveLimiter:
+    """Per-host adaptive concurrency and rate limits, plus an optional global cap on requests in flight.
+
+    Wrap each request in slot(url) and report its outcome with observe(), so
+    every host settles on the highest rate it sustains without throttling.
+    """
+
+    def __init__(self, max_concurrency, max_in_flight=None, max_rate=None, initial_concurrency=INITIAL_CONCURRENCY, metrics=None):
+        self.max_concurrency = max_concurrency
+        self.max_rate = max_rate
+        self.initial_concurrency = initial_concurrency
+        self._global = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        self._hosts = {}
+        self._lock = threading.Lock()
+        if metrics is not None:
+            self._limit_gauge = metrics.gauge("host_concurrency_limit", "Adaptive concurrency limit per host", ["host"])
+            self._rate_gauge = metrics.gauge("host_rate_limit", "Adaptive request rate limit per host, 0 when unlimited", ["host"])
+            self._throttled = metrics.counter("throttled_total", "Responses that fed back an error or throttling signal", ["host"])
+        else:
+            self._limit_gauge = self._rate_gauge = self._throttled = None
+
+    def host(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            limit = self._hosts.get(host)
+            if limit is None:
+                limit = self._hosts[host] = HostLimit(self.max_concurrency, self.max_rate, self.initial_concurrency)
+            return limit
+
+    @contextmanager
+    def slot(self, url):
+        """Hold a global slot and a host slot, waiting for a token and any Retry-After pause, while a request runs."""
+        host_limit = self.host(url)
+        if self._global is not None:
+            self._global.acquire()
+        try:
+            host_limit.acquire()
+            try:
+                yield
+            finally:
+                host_limit.release()
+        finally:
+            if self._global is not None:
+                self._global.release()
+
+    def observe(self, url, status, elapsed, retry_after=None):
+        """Report a response (status None for a connection error), its latency and its Retry-After header, if any.
+
+        Pass elapsed=None when the time includes retry back-off sleeps, so it does not read as congestion.
+        """
+        host_limit = self.host(url)
+        host_limit.observe(status, elapsed, parse_retry_after(retry_after))
+        if self._limit_gauge is not None:
+            host = urlparse(url).netloc
+            self._limit_gauge.set(int(host_limit.limit), host=host)
+            self._rate_gauge.set(0 if host_limit.rate == float("inf") else round(host_limit.rate, 1), host=host)
+            if status is None or status in FAILURE_STATUSES:
+                self._throttled.inc(host=host)
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import sqlite3
+import time
+import zlib
+
+CACHE_PATH = "divar_cache.sqlite"
+CACHE_TTL = 6 * 3600  # Seconds a cached response stays valid
+CACHE_MAX_BYTES = 512 * 1024 * 1024  # Least recently used responses are evicted beyond this size
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+)
+"""
+
+
+def payload_key(data):
+    """Hash the canonical JSON form of a request body, so equal payloads share a key regardless of key order."""
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResponseCache:
+    """On-disk cache of search response bodies keyed by request payload, with a TTL and LRU size limit."""
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "stored": 0, "evicted": 0}
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(SCHEMA)
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+        self._connection.commit()
+        self._total_bytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, data):
+        """Return the cached response body for a payload, or None on a miss."""
+        key = payload_key(data)
+        row = self._connection.execute("SELECT body, size, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+        body, size, created_at = row
+        if now - created_at > self.ttl:
+            self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._connection.commit()
+            self._total_bytes -= size
+            self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return None
+        self._connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        self._connection.commit()
+        self.stats["hits"] += 1
+        return zlib.decompress(body)
+
+    def put(self, data, body):
+        """Store a response body for a payload and evict old entries if the cache is over its size limit."""
+        key = payload_key(data)
+        compressed = zlib.compress(body)
+        now = time.time()
+        previous = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        self._connection.execute(
+            "INSERT OR REPLACE INTO responses (key, body, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, compressed, len(compressed), now, now),
+        )
+        self._total_bytes += len(compressed) - (previous[0] if previous else 0)
+        self.stats["stored"] += 1
+        self._evict()
+        self._connection.commit()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes:
+            rows = self._connection.execute("SELECT key, size FROM responses ORDER BY accessed_at LIMIT 100").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self.stats["evicted"] += 1
+
+    def summary(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = self.stats["hits"] / lookups * 100 if lookups else 0.0
+        return (
+            f"Cache: {self.stats['hits']} hits, {self.stats['misses']} misses ({hit_rate:.1f}% hit rate), "
+            f"{self.stats['expired']} expired, {self.stats['stored']} stored, {self.stats['evicted']} evicted, "
+            f"{self._total_bytes / 1024 / 1024:.1f} MB on disk"
+        )
+
+    def close(self):
+        self._connection.close()
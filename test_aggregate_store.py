@@ -0,0 +1,136 @@
+"""Checks that runs merge into the daily aggregates once, and that share queries honour their windows.
+
+    python -m unittest test_aggregate_store
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import divar
+from aggregate_store import AggregateStore
+from divar_replay import MockServer, sample_archive
+from response_cache import ResponseCache
+
+PUBLISHERS = ["YEKTANET", "tapsell", "WITHOUT UTM"]
+CSV_ROWS = 40
+
+
+class AggregateStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.path = os.path.join(self.workdir, "aggregates.sqlite")
+
+    def run_at(self, day, placements, time="12:00:00.000"):
+        """Merge one run made on day from (publisher_id, domain, impressions) placements."""
+        store = AggregateStore(PUBLISHERS, self.path, f"{day}T{time}")
+        for publisher_id, domain, impressions in placements:
+            store.add(publisher_id, domain, ["1"], [], "furniture", impressions)
+        merged = store.merge()
+        store.close()
+        return merged
+
+    def shares(self, *args, **kwargs):
+        store = AggregateStore(PUBLISHERS, self.path)
+        try:
+            return store.publisher_shares(*args, **kwargs)
+        finally:
+            store.close()
+
+    def test_windows_and_daily_partitioning(self):
+        self.run_at("2026-10-01", [(0, "a.ir", 10), (0, "b.ir", 30), (1, "c.ir", 60)])
+        self.run_at("2026-10-01", [(1, "c.ir", 100)], "18:00:00.000")  # A later run the same day adds to its rows
+        self.run_at("2026-10-02", [(2, "d.ir", 5), (2, "d.ir", 5), (0, "a.ir", 0)])
+
+        self.assertEqual(
+            self.shares(until="2026-10-01"),
+            [("YEKTANET", 2, 40, 0.5, 0.2), ("tapsell", 2, 160, 0.5, 0.8)],
+        )
+        self.assertEqual(
+            self.shares(since="2026-10-02"),
+            [("WITHOUT UTM", 2, 10, 2 / 3, 1.0), ("YEKTANET", 1, 0, 1 / 3, 0.0)],
+        )
+        daily = self.shares(daily=True)
+        self.assertEqual(
+            daily,
+            [
+                ("2026-10-01", "YEKTANET", 2, 40, 0.5, 0.2),
+                ("2026-10-01", "tapsell", 2, 160, 0.5, 0.8),
+                ("2026-10-02", "WITHOUT UTM", 2, 10, 2 / 3, 1.0),
+                ("2026-10-02", "YEKTANET", 1, 0, 1 / 3, 0.0),
+            ],
+        )
+        self.assertEqual(sum(row[1] for row in self.shares()), 7)
+
+    def test_a_run_merges_once(self):
+        store = AggregateStore(PUBLISHERS, self.path, "2026-10-01T12:00:00.000")
+        store.add(0, "a.ir", ["1"], [], "furniture", 10)
+        self.assertTrue(store.merge())
+        store.add(0, "a.ir", ["1"], [], "furniture", 10)
+        self.assertFalse(store.merge())
+        store.close()
+        self.assertFalse(self.run_at("2026-10-01", [(0, "a.ir", 10)]))  # Same run_at, e.g. a retried merge
+        self.assertEqual(self.shares(), [("YEKTANET", 1, 10, 1.0, 1.0)])
+
+    def test_interned_keys_resolve_on_merge(self):
+        store = AggregateStore(PUBLISHERS, self.path, "2026-10-01T12:00:00.000")
+        for cities, impressions in ((["1", "2"], 10), (["1"], 20), (["1", "2"], 30)):
+            store.add(0, "a.ir", cities, [], "furniture", impressions)
+        store.add(1, "a.ir", ["1"], [], "1", 5)  # A category that equals a city label is still its own column value
+        store.merge()
+        rows = store._connection.execute("SELECT publisher, domain, cities, category, ad_count, impression_count FROM daily ORDER BY 1, 3").fetchall()
+        store.close()
+        self.assertEqual(
+            rows,
+            [("YEKTANET", "a.ir", "1", "furniture", 1, 20), ("YEKTANET", "a.ir", "1-2", "furniture", 2, 40), ("tapsell", "a.ir", "1", "1", 1, 5)],
+        )
+
+    def test_close_without_merge_leaves_the_table_untouched(self):
+        store = AggregateStore(PUBLISHERS, self.path, "2026-10-01T12:00:00.000")
+        store.add(0, "a.ir", ["1"], [], "furniture", 10)
+        store.close()  # A run that failed before merging
+        self.assertEqual(self.shares(), [])
+
+    def test_cached_placements_are_not_merged_again(self):
+        store = AggregateStore(PUBLISHERS, self.path, "2026-10-01T12:00:00.000")
+        store.add(0, "a.ir", ["1"], [], "furniture", 10, True)
+        store.add(1, "c.ir", ["1"], [], "furniture", 20)
+        store.merge()
+        store.close()
+        self.assertEqual(self.shares(), [("tapsell", 1, 20, 1.0, 1.0)])
+
+
+class CachedRunTest(unittest.TestCase):
+    """A second run answered from the response cache adds nothing to the daily aggregates."""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.server = MockServer(sample_archive()).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.rows = [{"cities": str(i % 5 + 1), "neighborhoods": "0", "category": f"category-{i % 25}", "count": "70"} for i in range(CSV_ROWS)]
+
+    def run_once(self, run_at):
+        cache = ResponseCache(os.path.join(self.workdir, "cache.sqlite"))
+        store = AggregateStore(divar.CLASSIFIER.publishers, os.path.join(self.workdir, "aggregates.sqlite"), run_at)
+        counts, totals = divar.new_aggregates()
+        links = divar.iter_links(self.rows, url=self.server.url, cache=cache)
+        for url, row_data in divar.iter_redirected_urls(links):
+            divar.add_to_aggregates(counts, totals, url, row_data, store)
+        store.merge()
+        ads = store.domain_totals()
+        store.close()
+        cache.close()
+        return sum(data["ad_count"] for data in totals.values()), sum(row[2] for row in ads)
+
+    def test_second_run_is_served_from_cache_and_not_merged(self):
+        self.assertEqual(self.run_once("2026-10-01T10:00:00.000"), (CSV_ROWS, CSV_ROWS))
+        # The run still reports every row, but the daily table keeps the first run's observations only
+        self.assertEqual(self.run_once("2026-10-01T11:00:00.000"), (CSV_ROWS, CSV_ROWS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+"""Checks that the config-driven classifier reproduces the original hard-coded publisher rules.
+
+    python -m unittest test_classifier
+"""
+
+import random
+import unittest
+from collections import defaultdict
+from urllib.parse import urlparse
+
+from classifier import BannerClassifier, aggregate_by_domain, domain_of, load_classifier
+
+SEED = 4321
+URL_COUNT = 20000
+ALPHABET = "abdeilnkprstuvyADEKLNPSTUY/?&=.:-#_"
+TOKENS = ["adivery", "yektanet", "tapsell", "daart", "utm", "UTM", "Tapsell", "DAArt", "AdIvery", "yektanet.com", "utm_medium"]
+
+
+def original_publisher(url):
+    """The if-chain divar.py used before publishers.json existed."""
+    url = url.lower()
+    if "adivery" in url or "yektanet" in url:
+        return "YEKTANET"
+    elif "tapsell" in url:
+        return "tapsell"
+    elif "daart" in url:
+        return "DAART"
+    elif "utm" not in url:
+        return "WITHOUT UTM"
+    return "WITH UTM"
+
+
+def random_url(rng):
+    """A URL whose host and tail mix rule tokens with random noise, so tokens also straddle separators."""
+    parts = [rng.choice(TOKENS) if rng.random() < 0.3 else "".join(rng.choices(ALPHABET, k=rng.randint(0, 6))) for _ in range(rng.randint(0, 5))]
+    host = rng.choice(["landing.example.ir", "Tapsell.ir", "cdn.daart.ir", "x.utm.io:8443", "a-b.yektanet.com", "shop.ir"])
+    return f"{rng.choice(['https', 'http'])}://{host}/{''.join(parts)}"
+
+
+class ClassifierTest(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(SEED)
+        self.urls = [random_url(rng) for _ in range(URL_COUNT)]
+        self.classifier = load_classifier()
+
+    def test_classify_matches_original_rules(self):
+        for url in self.urls:
+            self.assertEqual(self.classifier.classify(url), original_publisher(url), url)
+
+    def test_classify_batch_matches_classify(self):
+        publisher_ids, domains = self.classifier.classify_batch(self.urls)
+        self.assertEqual([self.classifier.publishers[i] for i in publisher_ids], [original_publisher(url) for url in self.urls])
+        self.assertEqual(domains, [urlparse(url).netloc for url in self.urls])
+
+    def test_domain_of_matches_urlparse(self):
+        for url in self.urls + ["https://host", "https://host?x=1", "https://host#frag", "relative/path", "//host/x"]:
+            self.assertEqual(domain_of(url), urlparse(url).netloc, url)
+
+    def test_aggregate_by_domain(self):
+        impressions = [i % 97 for i in range(len(self.urls))]
+        publisher_ids, domains = self.classifier.classify_batch(self.urls)
+        expected = defaultdict(lambda: [0, 0])
+        for key, impression in zip(zip(publisher_ids, domains), impressions):
+            expected[key][0] += 1
+            expected[key][1] += impression
+        self.assertEqual(aggregate_by_domain(publisher_ids, domains, impressions), dict(expected))
+
+    def test_rule_order_decides_between_matches(self):
+        classifier = BannerClassifier([{"publisher": "A", "patterns": ["x"]}, {"publisher": "B", "patterns": ["X", "y"]}], "C")
+        self.assertEqual(classifier.classify("https://h/xy"), "A")
+        self.assertEqual(classifier.classify("https://h/Y"), "B")
+        self.assertEqual(classifier.classify("https://h/z"), "C")
+
+
+if __name__ == "__main__":
+    unittest.main()
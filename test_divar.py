@@ -0,0 +1,166 @@
+"""Checks that divar.py's streaming aggregation matches the original per-publisher if-chain,
+and that the process-pool post-processing matches the in-process path.
+
+    python -m unittest test_divar
+"""
+
+import base64
+import json
+import random
+import unittest
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import divar
+
+SEED = 1234
+URL_COUNT = 5000
+LINK_COUNT = 20000  # Banner links pushed through both post-processing paths
+DOMAINS = ["shop.example.ir", "Landing.Tapsi.Food", "www.digikala.com", "daart.ir", "a.b.c.example.com:8080"]
+FRAGMENTS = ["adivery", "YEKTANET", "tapsell", "DaArt", "utm_source=x", "UTM", "ref=home", "", "q=1"]
+
+
+def original_categorize(urls):
+    """The aggregation as it was before the streaming rewrite, with the five update blocks folded into one."""
+    counts = defaultdict(lambda: defaultdict(lambda: {"ad_count": 0, "impression_count": 0, "placements": []}))
+    totals_per_publisher = defaultdict(lambda: {"ad_count": 0, "impression_count": 0})
+    for url, row_data in urls:
+        domain = urlparse(url).netloc
+        url = url.lower()
+        row_count = int(row_data["row_count"]) // 7
+        if "adivery" in url or "yektanet" in url:
+            publisher = "YEKTANET"
+        elif "tapsell" in url:
+            publisher = "tapsell"
+        elif "daart" in url:
+            publisher = "DAART"
+        elif "utm" not in url:
+            publisher = "WITHOUT UTM"
+        else:
+            publisher = "WITH UTM"
+        counts[publisher][domain]["ad_count"] += 1
+        counts[publisher][domain]["impression_count"] += row_count
+        counts[publisher][domain]["placements"].append(
+            {"cities": row_data["cities"], "neighborhoods": row_data["neighborhoods"], "category": row_data["category"]}
+        )
+        totals_per_publisher[publisher]["ad_count"] += 1
+        totals_per_publisher[publisher]["impression_count"] += row_count
+    return counts, totals_per_publisher
+
+
+def random_urls(count=URL_COUNT, seed=SEED):
+    rng = random.Random(seed)
+    urls = []
+    for _ in range(count):
+        path = "/".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 3)))
+        query = "&".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 2)))
+        url = f"{rng.choice(['https', 'http'])}://{rng.choice(DOMAINS)}/{path}" + (f"?{query}" if query else "")
+        row_data = {
+            "row_count": str(rng.randint(0, 700)),
+            "cities": [str(rng.randint(1, 5))],
+            "neighborhoods": [str(rng.randint(1, 9)) for _ in range(rng.randint(0, 2))],
+            "category": rng.choice(["game-consoles-and-video-games", "furniture"]),
+        }
+        urls.append((url, row_data))
+    return urls
+
+
+def banner_link(url):
+    """Build a Divar banner link whose ext_link_data token redirects to url."""
+    parsed = urlparse(url)
+    claims = {"externalUrl": {"Scheme": parsed.scheme, "Host": parsed.netloc, "Path": parsed.path, "RawQuery": parsed.query}}
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).rstrip(b"=").decode()
+    return f"https://a-banners.divar.ir/auction/?ext_link_data=eyJhbGciOiJIUzI1NiJ9.{payload}.c2ln"
+
+
+def random_links(count=LINK_COUNT, seed=SEED):
+    """(link, row_data) pairs like iter_links yields, with a few links that carry no or a broken token."""
+    links = []
+    for url, row_data in random_urls(count, seed):
+        if len(links) % 500 == 1:
+            links.append((url, row_data))  # No ext_link_data at all
+        elif len(links) % 500 == 2:
+            links.append(("https://a-banners.divar.ir/auction/?ext_link_data=not-a-token", row_data))
+        else:
+            links.append((banner_link(url), row_data))
+    return links
+
+
+class RecordingSink:
+    """Collect placements per (publisher, domain) the way the original function kept them."""
+
+    def __init__(self):
+        self.placements = defaultdict(list)
+
+    def add(self, publisher_id, domain, cities, neighborhoods, category, impressions, cached=False):
+        publisher = divar.CLASSIFIER.publishers[publisher_id]
+        self.placements[publisher, domain].append({"cities": cities, "neighborhoods": neighborhoods, "category": category})
+
+    def sorted_placements(self):
+        """Placements in a canonical order, since pool batches are merged in completion order."""
+        return {key: sorted(values, key=json.dumps) for key, values in self.placements.items()}
+
+
+def plain(counts, totals_per_publisher):
+    """Drop empty publishers and defaultdicts so both sides compare as plain dicts."""
+    counts = {
+        publisher: {domain: {"ad_count": data["ad_count"], "impression_count": data["impression_count"]} for domain, data in domains.items()}
+        for publisher, domains in counts.items()
+        if domains
+    }
+    return counts, {publisher: dict(data) for publisher, data in totals_per_publisher.items()}
+
+
+class StreamingAggregationTest(unittest.TestCase):
+    def setUp(self):
+        self.urls = random_urls()
+        expected_counts, expected_totals = original_categorize(self.urls)
+        self.expected = plain(expected_counts, expected_totals)
+        self.expected_placements = {
+            (publisher, domain): data["placements"] for publisher, domains in expected_counts.items() for domain, data in domains.items()
+        }
+
+    def test_add_to_aggregates_matches_original(self):
+        counts, totals = divar.new_aggregates()
+        sink = RecordingSink()
+        for url, row_data in self.urls:
+            divar.add_to_aggregates(counts, totals, url, row_data, sink)
+        self.assertEqual(plain(counts, totals), self.expected)
+        self.assertEqual(dict(sink.placements), self.expected_placements)
+
+    def test_categorize_urls_and_aggregate_matches_original(self):
+        sink = RecordingSink()
+        self.assertEqual(plain(*divar.categorize_urls_and_aggregate(self.urls, sink)), self.expected)
+        self.assertEqual(dict(sink.placements), self.expected_placements)
+
+
+def link_results(since=None):
+    """links_total per result label, less the counts in since."""
+    values = {key[0]: value for key, value in divar.LINKS._values.items()}
+    return {result: count - (since or {}).get(result, 0) for result, count in values.items() if count != (since or {}).get(result, 0)}
+
+
+class PoolPostprocessTest(unittest.TestCase):
+    def test_pool_matches_in_process(self):
+        links = random_links()
+        counts, totals = divar.new_aggregates()
+        sink = RecordingSink()
+        before = link_results()
+        for url, row_data in divar.iter_redirected_urls(links):
+            divar.add_to_aggregates(counts, totals, url, row_data, sink)
+        results = link_results(before)
+
+        pool_counts, pool_totals = divar.new_aggregates()
+        pool_sink = RecordingSink()
+        before = link_results()
+        divar.postprocess_in_pool(links, pool_counts, pool_totals, pool_sink, processes=2, batch_size=1000)
+        self.assertEqual(link_results(before), results)
+        self.assertEqual(set(results), {"decoded", "no_token", "undecodable"})
+
+        self.assertEqual(plain(pool_counts, pool_totals), plain(counts, totals))
+        self.assertEqual(pool_sink.sorted_placements(), sink.sorted_placements())
+        self.assertEqual(sum(data["ad_count"] for data in totals.values()), LINK_COUNT - 2 * (LINK_COUNT // 500))
+
+
+if __name__ == "__main__":
+    unittest.main()
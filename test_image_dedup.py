@@ -0,0 +1,129 @@
+"""Checks that bucketed near-duplicate search finds exactly the brute-force pairs, and that pruning sticks.
+
+    python -m unittest test_image_dedup
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+
+import download
+import image_dedup
+from image_store import ImageStore
+from manifest import CrawlManifest
+
+SEED = 2024
+HASH_COUNT = 4000
+PLANTED = 1500  # Hashes derived from another one by flipping a few bits
+
+
+def planted_hashes(rng, count=HASH_COUNT, planted=PLANTED):
+    """Random 64-bit hashes, some of them copies of earlier ones with 0 to 10 bits flipped."""
+    hashes = rng.integers(0, 1 << 63, size=count, dtype=np.uint64) << np.uint64(1) | rng.integers(0, 2, size=count, dtype=np.uint64)
+    for target in rng.choice(np.arange(1, count), size=planted, replace=False):
+        value = int(hashes[rng.integers(0, target)])
+        for bit in rng.choice(64, size=rng.integers(0, 11), replace=False):
+            value ^= 1 << int(bit)
+        hashes[target] = value
+    return hashes
+
+
+def pair_set(lefts, rights):
+    return set(zip(lefts.tolist(), rights.tolist()))
+
+
+class PairsTest(unittest.TestCase):
+    def setUp(self):
+        self.hashes = planted_hashes(np.random.default_rng(SEED))
+
+    def test_bucketed_matches_brute_force(self):
+        for threshold in range(0, 8):
+            expected = pair_set(*image_dedup.brute_force_pairs(self.hashes, threshold))
+            self.assertTrue(expected, threshold)
+            self.assertEqual(pair_set(*image_dedup.bucketed_pairs(self.hashes, threshold)), expected, threshold)
+
+    def test_small_blocks_match_one_block(self):
+        expected = pair_set(*image_dedup.brute_force_pairs(self.hashes, 4))
+        self.assertEqual(pair_set(*image_dedup.brute_force_pairs(self.hashes, 4, block_elements=HASH_COUNT * 7)), expected)
+
+    def test_duplicate_groups_are_connected_components(self):
+        lefts, rights = np.array([0, 1, 5, 7]), np.array([1, 2, 6, 5])
+        groups = [sorted(group.tolist()) for group in image_dedup.duplicate_groups(9, lefts, rights)]
+        self.assertEqual(sorted(groups), [[0, 1, 2], [5, 6, 7]])
+
+
+def save_image(pixels, path, scale=1.0):
+    image = Image.fromarray(pixels)
+    if scale != 1.0:
+        image = image.resize((int(image.width * scale), int(image.height * scale)), Image.LANCZOS)
+    image.save(path, format="JPEG", quality=90)
+
+
+class PruneTest(unittest.TestCase):
+    """A pruned near-duplicate stays gone: downloads skip it and its stored object is freed."""
+
+    def setUp(self):
+        self.images_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.images_dir)
+        self.store = ImageStore(os.path.join(self.images_dir, ".store"))
+        self.manifest = CrawlManifest(os.path.join(self.store.root, "manifest.sqlite"))
+        self.addCleanup(self.manifest.close)
+
+        rng = np.random.default_rng(SEED)
+        blocks = Image.fromarray(rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)).resize((256, 256), Image.BILINEAR)
+        photo = np.asarray(blocks, dtype=np.float64)
+        sources = {
+            "https://images.test/large.jpeg": (photo.astype(np.uint8), 1.0),
+            "https://images.test/small.jpeg": (photo.astype(np.uint8), 0.75),  # Same photo, scaled down
+            "https://images.test/other.jpeg": ((255 - photo).astype(np.uint8), 1.0),  # Inverted, so every hash bit flips
+        }
+        self.urls = list(sources)
+        self.digests = {}
+        for url, (pixels, scale) in sources.items():
+            temp_path = self.store.temp_path()
+            save_image(pixels, temp_path, scale)
+            digest = image_dedup.file_sha256(temp_path)
+            self.store.add(temp_path, digest)
+            self.manifest.record_success(url, os.path.getsize(self.store.object_path(digest)), digest)
+            self.digests[url] = digest
+        self.link("cats", self.urls)
+
+    def link(self, keyword, urls):
+        jobs = download.build_jobs(urls, os.path.join(self.images_dir, keyword))
+        stats = download.new_stats()
+        pending, _ = download.plan_downloads(jobs, self.store, self.manifest, stats)
+        return jobs, pending, stats
+
+    def test_prune_persists_across_downloads(self):
+        index = image_dedup.HashIndex(os.path.join(self.images_dir, ".phash.npz"))
+        index.update(self.images_dir, processes=1)
+        groups = image_dedup.find_groups(index, same_keyword=True)
+        small_path = os.path.join(self.images_dir, "cats", "image_1.jpeg")
+        self.assertEqual([sorted(group) for group in groups], [sorted([os.path.join(self.images_dir, "cats", "image_0.jpeg"), small_path])])
+
+        self.assertEqual(image_dedup.prune(groups, self.manifest, self.store.root), [small_path])
+        self.assertFalse(os.path.exists(small_path))
+        self.assertFalse(self.store.has(self.digests[self.urls[1]]))  # No folder linked it any more
+
+        _, pending, stats = self.link("cats", self.urls)
+        self.assertEqual(pending, {})
+        self.assertEqual(stats["skipped"], 3)
+        self.assertFalse(os.path.exists(small_path))
+
+        # Other keywords are not affected by a prune in cats
+        _, pending, _ = self.link("dogs", self.urls[1:2])
+        self.assertEqual(list(pending), self.urls[1:2])
+
+    def test_prune_keeps_hardlinks_of_the_kept_image(self):
+        os.link(os.path.join(self.images_dir, "cats", "image_0.jpeg"), os.path.join(self.images_dir, "cats", "image_9.jpeg"))
+        group = [os.path.join(self.images_dir, "cats", name) for name in ("image_0.jpeg", "image_9.jpeg")]
+        self.assertEqual(image_dedup.prune([group], self.manifest, self.store.root), [])
+        self.assertEqual(self.manifest.excluded(), set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+"""Checks that opening the image store clears only abandoned temp files.
+
+    python -m unittest test_image_store
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import image_store
+from image_store import ImageStore
+
+
+class TempSweepTest(unittest.TestCase):
+    def setUp(self):
+        self.root = os.path.join(tempfile.mkdtemp(), ".store")
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.root))
+        self.store = ImageStore(self.root)
+
+    def write_temp(self, age):
+        path = self.store.temp_path()
+        with open(path, "wb") as file:
+            file.write(b"partial download")
+        then = time.time() - age
+        os.utime(path, (then, then))
+        return path
+
+    def test_another_process_keeps_its_in_flight_download(self):
+        in_flight = self.write_temp(age=5)
+        abandoned = self.write_temp(age=image_store.STALE_TEMP_SECONDS + 60)
+        ImageStore(self.root)  # A second process opening the same store
+        self.assertTrue(os.path.exists(in_flight))
+        self.assertFalse(os.path.exists(abandoned))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+"""Checks how the crawl manifest counts attempts and when plan_downloads gives up on a URL.
+
+    python -m unittest test_manifest
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+import download
+from image_store import ImageStore
+from manifest import CrawlManifest
+
+URL = "https://images.test/photo.jpeg"
+BODY = b"stored image bytes"
+
+
+class ManifestAttemptsTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.store = ImageStore(os.path.join(self.workdir, ".store"))
+        self.manifest = CrawlManifest(os.path.join(self.store.root, "manifest.sqlite"))
+        self.addCleanup(self.manifest.close)
+        self.image_path = os.path.join(self.workdir, "cats", "image_0.jpeg")
+
+    def store_image(self):
+        temp_path = self.store.temp_path()
+        with open(temp_path, "wb") as file:
+            file.write(BODY)
+        digest = hashlib.sha256(BODY).hexdigest()
+        self.store.add(temp_path, digest)
+        self.manifest.record_success(URL, len(BODY), digest, '"etag"')
+        return digest
+
+    def plan(self, revalidate=False):
+        stats = download.new_stats()
+        pending, stored = download.plan_downloads([(URL, self.image_path)], self.store, self.manifest, stats, revalidate)
+        return pending, stored, stats
+
+    def row(self):
+        return self.manifest.rows([URL])[URL]
+
+    def test_failed_revalidation_keeps_the_stored_image(self):
+        digest = self.store_image()
+        for _ in range(download.MAX_ATTEMPTS - 1):
+            self.manifest.record_not_modified(URL)
+        self.manifest.record_failure(URL)  # A 503 to the conditional GET
+        self.assertEqual((self.row()["status"], self.row()["attempts"], self.row()["sha256"]), ("done", 1, digest))
+
+        os.makedirs(os.path.dirname(self.image_path))
+        pending, _, stats = self.plan()
+        self.assertEqual((pending, stats["linked"], stats["failed"]), ({}, 1, 0))
+        pending, stored, _ = self.plan(revalidate=True)
+        self.assertEqual((pending, list(stored)), ({URL: [self.image_path]}, [URL]))
+
+    def test_successes_and_revalidations_reset_the_attempts(self):
+        for _ in range(download.MAX_ATTEMPTS - 1):
+            self.manifest.record_failure(URL)
+        self.store_image()
+        self.assertEqual(self.row()["attempts"], 0)
+        self.manifest.record_failure(URL)
+        self.manifest.record_not_modified(URL)
+        self.assertEqual((self.row()["status"], self.row()["attempts"]), ("done", 0))
+
+    def test_gives_up_after_consecutive_failures(self):
+        for attempt in range(download.MAX_ATTEMPTS):
+            pending, _, _ = self.plan()
+            self.assertEqual(list(pending), [URL], attempt)
+            self.manifest.record_failure(URL)
+        pending, _, stats = self.plan()
+        self.assertEqual((pending, stats["failed"]), ({}, 1))
+        self.assertEqual(self.row()["status"], "failed")
+
+
+if __name__ == "__main__":
+    unittest.main()
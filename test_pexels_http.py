@@ -0,0 +1,117 @@
+"""Checks the browserless Pexels collector against saved search result pages served locally.
+
+    python -m unittest test_pexels_http
+"""
+
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pexels_http
+
+PAGE_PATHS = {1: "pexels_search_sample_1.html", 2: "pexels_search_sample_2.html"}
+MARKUP_PATH = "pexels_search_markup_sample.html"  # The first page as rendered markup, without __NEXT_DATA__
+
+
+def read(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return file.read()
+
+
+def photo_url(photo_id, query="auto=compress&cs=tinysrgb&h=350"):
+    return f"https://images.pexels.com/photos/{photo_id}/pexels-photo-{photo_id}.jpeg?{query}"
+
+
+FIRST_PAGE_IDS = [6207815, 1866149, 6032280, 276583, 7195533, 4050388]
+SECOND_PAGE_IDS = [5824519, 1571460, 6186812, 3932930]  # Page 2 also repeats 6032280 from page 1
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """Serve the saved pages by ?page=; pages past the last repeat it, as the site does, or 404 when missing is set."""
+
+    daemon_threads = True
+
+    def __init__(self, pages, missing=False):
+        super().__init__(("127.0.0.1", 0), FixtureHandler)
+        self.pages = pages
+        self.missing = missing
+        self.requested = []
+
+    @property
+    def base(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        page = int(parse_qs(parsed.query).get("page", ["1"])[0])
+        self.server.requested.append((parsed.path, page))
+        body = self.server.pages.get(page)
+        if body is None and not self.server.missing:
+            body = self.server.pages[max(self.server.pages)]
+        status, body = (200, body.encode()) if body is not None else (404, b"")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ParseImageUrlsTest(unittest.TestCase):
+    def test_next_data_results_in_page_order(self):
+        self.assertEqual(pexels_http.parse_image_urls(read(PAGE_PATHS[1])), [photo_url(photo_id) for photo_id in FIRST_PAGE_IDS])
+
+    def test_markup_fallback_keeps_one_url_per_photo(self):
+        urls = pexels_http.parse_image_urls(read(MARKUP_PATH))
+        # Avatars are skipped, entities decoded, and the srcset's 2x copy dropped
+        self.assertEqual(urls, [photo_url(photo_id, "auto=compress&cs=tinysrgb&w=600&lazy=load") for photo_id in FIRST_PAGE_IDS])
+
+    def test_unreadable_next_data_falls_back_to_markup(self):
+        html = read(PAGE_PATHS[1]).replace('"props":{', '"props":{,', 1)
+        self.assertEqual([url.split("?")[0] for url in pexels_http.parse_image_urls(html)], [photo_url(photo_id).split("?")[0] for photo_id in FIRST_PAGE_IDS])
+
+
+class CollectImageUrlsTest(unittest.TestCase):
+    def serve(self, pages, missing=False):
+        server = FixtureServer(pages, missing)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        session = pexels_http.create_session()
+        self.addCleanup(session.close)
+        return server, session
+
+    def test_pages_until_a_page_adds_nothing(self):
+        server, session = self.serve({page: read(path) for page, path in PAGE_PATHS.items()})
+        urls = pexels_http.collect_image_urls(session, "pictorial carpet", 100, server.base)
+        self.assertEqual(urls, [photo_url(photo_id) for photo_id in FIRST_PAGE_IDS + SECOND_PAGE_IDS])
+        self.assertEqual(server.requested, [("/search/pictorial%20carpet/", page) for page in (1, 2, 3)])
+
+    def test_stops_at_the_limit(self):
+        server, session = self.serve({page: read(path) for page, path in PAGE_PATHS.items()})
+        urls = pexels_http.collect_image_urls(session, "carpet", 8, server.base)
+        self.assertEqual(urls, [photo_url(photo_id) for photo_id in FIRST_PAGE_IDS + SECOND_PAGE_IDS[:2]])
+        self.assertEqual([page for _, page in server.requested], [1, 2])
+
+    def test_stops_at_a_failed_page(self):
+        server, session = self.serve({1: read(PAGE_PATHS[1])}, missing=True)
+        urls = pexels_http.collect_image_urls(session, "carpet", 100, server.base)
+        self.assertEqual(urls, [photo_url(photo_id) for photo_id in FIRST_PAGE_IDS])
+        self.assertEqual([page for _, page in server.requested], [1, 2])
+
+    def test_markup_pages_are_collected_too(self):
+        server, session = self.serve({1: read(MARKUP_PATH)})
+        urls = pexels_http.collect_image_urls(session, "carpet", 100, server.base)
+        self.assertEqual(len(urls), len(FIRST_PAGE_IDS))
+        self.assertEqual([page for _, page in server.requested], [1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,200 @@
+"""Checks the AIMD and Retry-After behaviour of rate_limiter.HostLimit and AdaptiveLimiter.
+
+    python -m unittest test_rate_limiter
+"""
+
+import threading
+import time
+import unittest
+from email.utils import formatdate
+from unittest import mock
+
+import rate_limiter
+from rate_limiter import AdaptiveLimiter, HostLimit, parse_retry_after
+
+
+class FakeClock:
+    """Stands in for the time module inside rate_limiter, so feedback can be replayed at chosen instants."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return time.time()
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class ParseRetryAfterTest(unittest.TestCase):
+    def test_delta_seconds(self):
+        self.assertEqual(parse_retry_after("3"), 3.0)
+        self.assertEqual(parse_retry_after("1.5"), 1.5)
+        self.assertEqual(parse_retry_after("-4"), 0.0)
+
+    def test_http_date(self):
+        self.assertAlmostEqual(parse_retry_after(formatdate(time.time() + 30, usegmt=True)), 30, delta=2)
+        self.assertEqual(parse_retry_after(formatdate(time.time() - 30, usegmt=True)), 0.0)
+
+    def test_missing_or_malformed(self):
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after(""))
+        self.assertIsNone(parse_retry_after("soon"))
+
+
+class HostLimitTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(rate_limiter, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.host = HostLimit(max_concurrency=32)
+
+    def succeed(self, count, latency=0.1, step=0.01):
+        for _ in range(count):
+            self.clock.advance(step)
+            self.host.observe(200, latency)
+
+    def test_slow_start_adds_one_per_success_up_to_the_ceiling(self):
+        self.assertEqual(self.host.limit, rate_limiter.INITIAL_CONCURRENCY)
+        self.succeed(5)
+        self.assertEqual(self.host.limit, rate_limiter.INITIAL_CONCURRENCY + 5)
+        self.succeed(100)
+        self.assertEqual(self.host.limit, 32)
+
+    def test_throttling_halves_the_limit_pauses_the_host_and_engages_the_rate(self):
+        self.succeed(12)
+        limit = self.host.limit
+        self.clock.advance(rate_limiter.DECREASE_INTERVAL)
+        self.host.observe(429, None, retry_after=2.0)
+        self.assertEqual(self.host.limit, limit * rate_limiter.DECREASE_FACTOR)
+        self.assertFalse(self.host.slow_start)
+        self.assertEqual(self.host.blocked_until, self.clock.now + 2.0)
+        self.assertLess(self.host.rate, float("inf"))
+
+    def test_a_burst_of_throttling_decreases_once_per_interval(self):
+        self.succeed(12)
+        self.clock.advance(rate_limiter.DECREASE_INTERVAL)
+        self.host.observe(429, None, retry_after=1.0)
+        limit = self.host.limit
+        for _ in range(10):
+            self.host.observe(429, None, retry_after=1.0)
+        self.assertEqual(self.host.limit, limit)
+        self.clock.advance(rate_limiter.DECREASE_INTERVAL)
+        self.host.observe(429, None, retry_after=1.0)
+        self.assertEqual(self.host.limit, limit * rate_limiter.DECREASE_FACTOR)
+
+    def test_additive_increase_after_the_first_decrease(self):
+        self.succeed(12)
+        self.clock.advance(rate_limiter.DECREASE_INTERVAL)
+        self.host.observe(503, None, retry_after=0)
+        limit = self.host.limit
+        self.succeed(1)
+        self.assertAlmostEqual(self.host.limit, limit + 1 / limit)
+
+    def test_sporadic_errors_stay_below_tolerance(self):
+        self.succeed(20)
+        limit = self.host.limit
+        for _ in range(20):
+            self.succeed(19)
+            self.clock.advance(0.01)
+            self.host.observe(500, None)  # 5% errors, below ERROR_TOLERANCE
+        self.assertGreaterEqual(self.host.limit, limit)
+
+    def test_sustained_errors_halve_the_limit(self):
+        self.succeed(20)
+        limit = self.host.limit
+        self.clock.advance(rate_limiter.DECREASE_INTERVAL)
+        for _ in range(20):
+            self.clock.advance(0.01)
+            self.host.observe(None, None)  # Connection errors
+        self.assertEqual(self.host.limit, limit * rate_limiter.DECREASE_FACTOR)
+        self.assertEqual(self.host.rate, float("inf"))  # Errors without throttling leave the rate alone
+
+    def test_latency_growth_shrinks_the_limit_gently(self):
+        self.succeed(rate_limiter.LATENCY_WARMUP + 10, latency=0.1)
+        self.clock.advance(1)
+        for _ in range(30):
+            limit = self.host.limit
+            self.clock.advance(0.01)
+            self.host.observe(200, 0.5)
+            if self.host.limit < limit:
+                break
+        self.assertAlmostEqual(self.host.limit, limit * rate_limiter.LATENCY_DECREASE_FACTOR)
+        self.assertFalse(self.host.slow_start)
+
+    def test_throttled_rate_regrows_and_is_lifted(self):
+        self.host = HostLimit(max_concurrency=8)  # Concurrency caps the rate at 8 / 0.1s once the limit regrows
+        self.succeed(12)
+        self.clock.advance(rate_limiter.DECREASE_INTERVAL)
+        self.host.observe(429, None, retry_after=0)
+        rate = self.host.rate
+        self.succeed(1)
+        self.assertAlmostEqual(self.host.rate, rate + rate_limiter.RATE_GROWTH)
+        self.succeed(2000)
+        self.assertEqual(self.host.rate, float("inf"))
+
+    def test_acquire_proceeds_once_the_pause_is_over(self):
+        self.clock.advance(rate_limiter.DECREASE_INTERVAL)
+        self.host.observe(429, None, retry_after=0.3)
+        self.clock.advance(0.3)
+        self.host.tokens = 1.0
+        self.host.acquire()  # The pause is over by the fake clock, so this does not block
+        self.host.release()
+        self.assertEqual(self.host.in_flight, 0)
+
+
+class AdaptiveLimiterTest(unittest.TestCase):
+    def test_retry_after_blocks_new_requests_in_real_time(self):
+        limiter = AdaptiveLimiter(max_concurrency=4)
+        limiter.observe("http://a.test/x", 429, None, "0.3")
+        start = time.monotonic()
+        with limiter.slot("http://a.test/y"):
+            pass
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+        start = time.monotonic()
+        with limiter.slot("http://b.test/y"):  # Other hosts are not paused
+            pass
+        self.assertLess(time.monotonic() - start, 0.1)
+
+    def test_slot_holds_requests_beyond_the_host_limit(self):
+        limiter = AdaptiveLimiter(max_concurrency=2, initial_concurrency=2)
+        entered = []
+        release = threading.Event()
+
+        def request():
+            with limiter.slot("http://a.test/"):
+                entered.append(1)
+                release.wait()
+
+        threads = [threading.Thread(target=request) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        self.assertEqual(len(entered), 2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(entered), 3)
+
+    def test_metrics_follow_the_host_limit(self):
+        registry = rate_limiter_registry()
+        limiter = AdaptiveLimiter(max_concurrency=8, metrics=registry)
+        limiter.observe("http://a.test/", 200, 0.05)
+        limiter.observe("http://a.test/", 503, None)
+        text = registry.render()
+        self.assertIn('test_host_concurrency_limit{host="a.test"} 5', text)
+        self.assertIn('test_throttled_total{host="a.test"} 1', text)
+
+
+def rate_limiter_registry():
+    from metrics import Registry
+
+    return Registry("test_")
+
+
+if __name__ == "__main__":
+    unittest.main()
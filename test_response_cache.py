@@ -0,0 +1,111 @@
+"""Checks TTL expiry, LRU eviction and the size accounting of response_cache.ResponseCache.
+
+    python -m unittest test_response_cache
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import response_cache
+from response_cache import ResponseCache
+
+TTL = 60
+BODY_SIZE = 1000  # Random bytes, so zlib cannot shrink them and each entry takes about this much
+
+
+class FakeClock:
+    """Stands in for the time module inside response_cache, so entries can age without sleeping."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def payload(name):
+    return {"city_ids": ["1"], "category": name}
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.path = os.path.join(self.workdir, "cache.sqlite")
+        self.clock = FakeClock()
+        patcher = mock.patch.object(response_cache, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.rng = random.Random(7)
+
+    def open(self, max_bytes=response_cache.CACHE_MAX_BYTES):
+        cache = ResponseCache(self.path, TTL, max_bytes)
+        self.addCleanup(cache.close)
+        return cache
+
+    def body(self):
+        return self.rng.randbytes(BODY_SIZE)
+
+    def stored_bytes(self, cache):
+        return cache._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def keys(self, cache):
+        rows = cache._connection.execute("SELECT key FROM responses").fetchall()
+        return {key for key, in rows}
+
+    def test_entries_expire_after_the_ttl(self):
+        cache = self.open()
+        body = self.body()
+        cache.put(payload("a"), body)
+        self.clock.advance(TTL - 1)
+        self.assertEqual(cache.get(payload("a")), body)
+        self.clock.advance(2)  # Reading does not extend the TTL
+        self.assertIsNone(cache.get(payload("a")))
+        self.assertEqual((cache.stats["hits"], cache.stats["misses"], cache.stats["expired"]), (1, 1, 1))
+        self.assertEqual((cache._total_bytes, self.stored_bytes(cache)), (0, 0))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = self.open(max_bytes=int(BODY_SIZE * 3.5))
+        for name in "abc":
+            cache.put(payload(name), self.body())
+            self.clock.advance(1)
+        self.assertIsNotNone(cache.get(payload("a")))  # a is now the most recently used
+        self.clock.advance(1)
+        cache.put(payload("d"), self.body())
+
+        self.assertEqual(self.keys(cache), {response_cache.payload_key(payload(name)) for name in "acd"})
+        self.assertEqual(cache.stats["evicted"], 1)
+        self.assertEqual(cache._total_bytes, self.stored_bytes(cache))
+        self.assertLessEqual(cache._total_bytes, cache.max_bytes)
+
+    def test_replacing_an_entry_counts_its_size_once(self):
+        cache = self.open(max_bytes=int(BODY_SIZE * 1.5))
+        cache.put(payload("a"), self.body())
+        cache.put(payload("a"), self.body())
+        self.assertEqual(cache.stats["evicted"], 0)
+        self.assertEqual(cache._total_bytes, self.stored_bytes(cache))
+
+    def test_an_entry_over_the_limit_is_not_kept(self):
+        cache = self.open(max_bytes=BODY_SIZE // 2)
+        cache.put(payload("a"), self.body())
+        self.assertIsNone(cache.get(payload("a")))
+        self.assertEqual((cache._total_bytes, cache.stats["evicted"]), (0, 1))
+
+    def test_reopening_recounts_the_stored_bytes(self):
+        cache = self.open()
+        for name in "ab":
+            cache.put(payload(name), self.body())
+        total = cache._total_bytes
+        cache.close()
+        self.assertEqual(self.open()._total_bytes, total)
+
+
+if __name__ == "__main__":
+    unittest.main()